@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+'''Times re list, pull and compact on synthetic workspaces of increasing size
+and writes the results as JSON, eg.
+
+    $ python bench/bench.py --scale 10x4x50 --scale 100x4x50 -o results.json
+
+A scale is written as repos x branches x commits. The number of processes
+each command spawns is counted from the trace written by --profile-trace.'''
+
+from __future__ import absolute_import
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from farm import Farm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RE = os.path.join(ROOT, 'bin', 're')
+
+
+def parse_scale(s):
+    repos, branches, commits = [int(x) for x in s.lower().split('x')]
+    return repos, branches, commits
+
+
+def git_version():
+    out = subprocess.check_output(['git', '--version'])
+    return out.decode().strip()
+
+
+def re_revision():
+    '''The commit of re being measured, if run from a checkout.'''
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                      cwd=ROOT, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode().strip()
+
+
+class Runner(object):
+    def __init__(self, workdir, repeat, jobs):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.jobs = jobs
+
+    def run_re(self, farm, args):
+        '''Runs re in the workspace, returning the wall time and the number
+        of processes it spawned.'''
+        trace = os.path.join(self.workdir, 'trace.json')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([ROOT, env.get('PYTHONPATH', '')])
+
+        cmd = [sys.executable, RE] + args + ['--profile-trace', trace]
+        with open(os.devnull, 'w') as devnull:
+            start = time.time()
+            ret = subprocess.call(cmd, cwd=farm.workspace, env=env,
+                                  stdin=subprocess.PIPE, stdout=devnull,
+                                  stderr=devnull)
+            elapsed = time.time() - start
+        if ret:
+            raise RuntimeError('re %s exited with %s' % (' '.join(args), ret))
+
+        with open(trace) as fp:
+            processes = len(json.load(fp)['traceEvents'])
+        return elapsed, processes
+
+    def measure(self, farm, name, args, before=None):
+        times, processes = [], []
+        for _ in range(self.repeat):
+            if before:
+                before()
+            elapsed, count = self.run_re(farm, args)
+            times.append(elapsed)
+            processes.append(count)
+
+        times.sort()
+        result = {
+            'command': name,
+            'args': args,
+            'times': times,
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'processes': max(processes),
+        }
+        sys.stderr.write('  %-14s median %8.3fs  %6d processes\n' %
+                         (name, result['median'], result['processes']))
+        return result
+
+    def bench_scale(self, repos, branches, commits):
+        sys.stderr.write('%d repos x %d branches x %d commits\n' %
+                         (repos, branches, commits))
+        farm = Farm(os.path.join(self.workdir, 'farm'), repos, branches, commits)
+        farm.create()
+
+        pull = ['pull']
+        if self.jobs:
+            pull += ['-j', str(self.jobs)]
+
+        results = []
+        # the first pull clones every repo
+        results.append(self.measure(farm, 'pull-clone', pull,
+                                    before=lambda: self.reset(farm)))
+        results.append(self.measure(farm, 'list', ['list']))
+        results.append(self.measure(farm, 'pull-noop', pull))
+        results.append(self.measure(farm, 'pull-changes', pull,
+                                    before=farm.advance))
+        results.append(self.measure(farm, 'status', ['status']))
+        results.append(self.measure(farm, 'compact-check', ['compact']))
+        results.append(self.measure(farm, 'compact', ['compact', '-c']))
+
+        scale = {'repos': repos, 'branches': branches, 'commits': commits}
+        for result in results:
+            result['scale'] = scale
+        return results
+
+    def reset(self, farm):
+        '''Removes the checkouts, so that the next pull clones again.'''
+        for name in farm.names():
+            path = os.path.join(farm.workspace, name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+
+def main():
+    optparser = optparse.OptionParser(usage='%prog [options]')
+    optparser.add_option('-s', '--scale', action='append', default=[],
+                         help='Repos x branches x commits, can be repeated')
+    optparser.add_option('-n', '--repeat', action='store', type='int', default=3,
+                         help='Number of runs per command')
+    optparser.add_option('-j', '--jobs', action='store', type='int',
+                         help='Passed on to re pull')
+    optparser.add_option('-w', '--workdir', action='store',
+                         help='Where to build the repos')
+    optparser.add_option('-o', '--output', action='store', default='bench.json',
+                         help='File to write the results to')
+    (options, args) = optparser.parse_args()
+
+    scales = [parse_scale(s) for s in options.scale or ['10x4x50', '50x4x50']]
+    workdir = options.workdir or tempfile.mkdtemp(prefix='re-bench-')
+
+    runner = Runner(workdir, options.repeat, options.jobs)
+    results = []
+    for repos, branches, commits in scales:
+        results.extend(runner.bench_scale(repos, branches, commits))
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': re_revision(),
+            'python': platform.python_version(),
+            'git': git_version(),
+            'platform': platform.platform(),
+            'repeat': options.repeat,
+            'jobs': options.jobs,
+        },
+        'results': results,
+    }
+    with open(options.output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    sys.stderr.write('Wrote %s\n' % options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+
+
+class Farm(object):
+    '''A workspace of repos backed by local bare repos, reached over file://
+    so that no network is needed. History is written with git fast-import,
+    one process per repo, so that large farms are quick to build.'''
+
+    author = 'Bench <bench@example.com>'
+    epoch = 1500000000
+
+    def __init__(self, root, repos, branches, commits):
+        self.root = os.path.abspath(root)
+        self.repos = repos
+        self.branches = branches
+        self.commits = max(commits, 1)
+        self.clock = self.epoch
+
+    @property
+    def upstream_dir(self):
+        return os.path.join(self.root, 'upstream')
+
+    @property
+    def workspace(self):
+        return os.path.join(self.root, 'workspace')
+
+    def names(self):
+        return ['repo%04d' % i for i in range(self.repos)]
+
+    def upstream(self, name):
+        return os.path.join(self.upstream_dir, '%s.git' % name)
+
+    def git(self, cwd, args, stdin=None):
+        popen = subprocess.Popen(['git'] + args, cwd=cwd,
+                                 stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = popen.communicate(stdin)
+        if popen.returncode:
+            raise RuntimeError('git %s failed in %s: %s' %
+                               (' '.join(args), cwd, err.decode()))
+        return out.decode()
+
+    def commit(self, ref, message, content, parent=None):
+        '''Returns a fast-import command for a commit changing one file.'''
+        self.clock += 60
+        lines = ['commit %s' % ref,
+                 'committer %s %d +0000' % (self.author, self.clock),
+                 'data %d' % len(message), message]
+        if parent:
+            lines.append('from %s' % parent)
+        lines += ['M 644 inline file.txt', 'data %d' % len(content), content, '']
+        return '\n'.join(lines)
+
+    def create(self):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.upstream_dir)
+        os.makedirs(self.workspace)
+
+        for name in self.names():
+            path = self.upstream(name)
+            self.git(self.upstream_dir, ['init', '-q', '--bare', path])
+            self.git(path, ['symbolic-ref', 'HEAD', 'refs/heads/master'])
+
+            stream = []
+            for i in range(self.commits):
+                stream.append(self.commit('refs/heads/master', 'commit %d' % i,
+                                          '%s %d\n' % (name, i)))
+            # each branch forks off master and adds a commit of its own
+            for i in range(1, self.branches):
+                ref = 'refs/heads/branch%03d' % i
+                stream.append(self.commit(ref, 'branch %d' % i, 'branch %d\n' % i,
+                                          parent='refs/heads/master'))
+            self.git(path, ['fast-import', '--quiet'],
+                     stdin='\n'.join(stream).encode())
+
+        self.write_config()
+
+    def write_config(self):
+        with open(os.path.join(self.workspace, '.reconfig'), 'w') as fp:
+            for name in self.names():
+                fp.write('[%s:git]\n' % name)
+                fp.write('    origin.url = file://%s\n' % self.upstream(name))
+
+    def advance(self, count=None):
+        '''Adds a commit to master in the first count upstreams, all of them
+        by default.'''
+        names = self.names()
+        if count is not None:
+            names = names[:count]
+
+        for name in names:
+            path = self.upstream(name)
+            stream = self.commit('refs/heads/master', 'advance', '%s %d\n' % (name, self.clock),
+                                 parent='refs/heads/master^0')
+            self.git(path, ['fast-import', '--quiet'], stdin=stream.encode())
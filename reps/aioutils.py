@@ -0,0 +1,70 @@
+'''asyncio versions of the helpers in ioutils. Python 3 only.'''
+
+from __future__ import absolute_import
+
+import asyncio
+import logging
+import time
+
+import ansicolor
+
+from reps import ioutils
+
+logger = logging
+
+
+async def invoke(cwd, args, timeout=None):
+    '''Like ioutils.invoke, but runs the command without blocking the event
+    loop.'''
+    logger.debug("Invoking: [%s] '%s'" % (cwd, ' '.join(args)))
+    start = time.time()
+    proc = await asyncio.create_subprocess_exec(*args, cwd=cwd,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE,
+                                                **ioutils.get_session_kwargs(timeout))
+    killed = False
+    try:
+        (out, err) = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        killed = True
+        ioutils.kill_session(proc)
+        (out, err) = await proc.communicate()
+
+    ioutils.record_invocation(cwd, args, start, proc.returncode, len(out) + len(err))
+    out = ioutils.maybe_decode(out).strip()
+    err = ioutils.maybe_decode(err).strip()
+    ret = proc.returncode
+    if killed:
+        ret = ioutils.TIMED_OUT
+        err = 'Timed out after %ss' % timeout
+    if out:
+        lines = out.split('\n')
+        for line in lines:
+            logger.debug("> %s" % ansicolor.blue(line))
+    if ret:
+        if not err:
+            err = ret
+        logger.warn("Returned %s" % (err))
+    return ret, out, err
+
+
+async def run_network(policy, path, operation, args):
+    '''Like NetworkPolicy.run, with the retries waiting on the event loop.'''
+    args = policy.get_args(args)
+    timeout = policy.get_timeout(operation)
+    attempt = 0
+    while True:
+        ret, out, err = await invoke(path, args, timeout=timeout)
+        if not ret:
+            return ret, out, err
+
+        if not policy.should_retry(attempt, ret, err):
+            policy.record_timeout(path, operation, ret)
+            return ret, out, err
+
+        delay = policy.get_delay(attempt)
+        logger.info("Retrying %s for '%s' after: %s" % (operation, path, err))
+        ioutils.complain('Retrying %s of %s in %.1fs' % (operation, path, delay),
+                         minor=True)
+        await asyncio.sleep(delay)
+        attempt += 1
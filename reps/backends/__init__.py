@@ -1,4 +1,6 @@
 from __future__ import absolute_import
 
 
-from reps.backends.git import Git  # noqa
+# reads refs and config straight from .git where it can, and runs git for
+# everything else
+from reps.backends.gitnative import GitNative as Git  # noqa
@@ -3,13 +3,37 @@ from __future__ import absolute_import
 import logging
 import os
 import re
+import shutil
 
 from reps import ioutils
+from reps.network import NetworkPolicy
+from reps.settings import Settings
 
 logger = logging
 
 
 class Git(object):
+    # how commands that talk to a remote are run, replaced by the program
+    # with one configured from the workspace settings
+    network = NetworkPolicy.from_settings(Settings())
+
+    # the version of git, read once
+    version = None
+
+    @classmethod
+    def get_version(cls):
+        '''The version of git as a tuple of ints, eg. (2, 39, 5), or () if it
+        cannot be told.'''
+        if cls.version is None:
+            ret, out, err = ioutils.invoke('.', ['git', '--version'])
+            m = not ret and re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', out)
+            if m:
+                cls.version = tuple(int(n) for n in m.groups() if n is not None)
+            else:
+                logger.warn('Could not get the version of git: %s' % err)
+                cls.version = ()
+        return cls.version
+
     @classmethod
     def repo_init(cls, path):
         ret, out, err = ioutils.invoke(path, ['git', 'init'])
@@ -17,6 +41,45 @@ class Git(object):
             logger.error("Could not init repo '%s': %s" %
                          (path, err))
 
+    @classmethod
+    def repo_init_bare(cls, path, shared=None):
+        '''With shared (eg. group), the repo is made writable by other users
+        as in git init --shared.'''
+        args = ['git', 'init', '--bare']
+        if shared:
+            args += ['--shared=%s' % shared]
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.error("Could not init bare repo '%s': %s" %
+                         (path, err))
+        else:
+            return True
+
+    @classmethod
+    def get_alternates_file(cls, path):
+        return os.path.join(path, '.git', 'objects', 'info', 'alternates')
+
+    @classmethod
+    def get_alternates(cls, path):
+        '''Returns the object directories the repo borrows objects from.'''
+        try:
+            with open(cls.get_alternates_file(path)) as fp:
+                lines = fp.readlines()
+        except (IOError, OSError):
+            return []
+        return [line.strip() for line in lines
+                if line.strip() and not line.startswith('#')]
+
+    @classmethod
+    def set_alternates(cls, path, dirs):
+        filepath = cls.get_alternates_file(path)
+        if not dirs:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return
+        with open(filepath, 'w') as fp:
+            fp.write(''.join('%s\n' % d for d in dirs))
+
     @classmethod
     def get_checked_out_commit(cls, path):
         branches = cls._get_branches_local(path)
@@ -51,25 +114,29 @@ class Git(object):
         return True
 
     @classmethod
-    def commit_is_ahead_of(cls, path, first, second):
+    def count_ahead_behind(cls, path, first, second):
+        '''Returns the number of commits first has that second does not, and
+        vice versa, without listing the history of either.'''
         # NOTE: terminate with -- to ensure the branch name is not mistaken for
         # a path with a matching name
-        ret1, out1, err1 = ioutils.invoke(path, ['git', 'rev-list', first, '--'])
-        if ret1:
-            logger.error("Could not get log for branch %s for '%s': %s" %
-                         (first, path, err1))
+        args = ['git', 'rev-list', '--left-right', '--count',
+                '%s...%s' % (first, second), '--']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.error("Could not compare branches %s and %s for '%s': %s" %
+                         (first, second, path, err))
+            return None
 
-        # NOTE: terminate with -- to ensure the branch name is not mistaken for
-        # a path with a matching name
-        ret2, out2, err2 = ioutils.invoke(path, ['git', 'rev-list', second, '--'])
-        if ret2:
-            logger.error("Could not get log for branch %s for '%s': %s" %
-                         (second, path, err2))
-
-        log = out1.split('\n')[1:]
-        commit = out2.split('\n')[0]
-        if commit in log:
-            return True
+        ahead, behind = out.split()
+        return int(ahead), int(behind)
+
+    @classmethod
+    def commit_is_ahead_of(cls, path, first, second):
+        counts = cls.count_ahead_behind(path, first, second)
+        if counts:
+            ahead, behind = counts
+            if ahead and not behind:
+                return True
         return False
 
     @classmethod
@@ -107,6 +174,44 @@ class Git(object):
             logger.error("Could not set config %s=%s for '%s': %s" %
                          (key, value, path, err))
 
+    @classmethod
+    def set_conf_keys(cls, path, pairs):
+        for key, value in pairs:
+            cls.set_conf_key(path, key, value)
+
+    @classmethod
+    def set_conf_key_all(cls, path, key, values):
+        '''Replaces all the values of a multi-valued key, eg. the refspecs of
+        a remote. No values unsets the key.'''
+        ret, out, err = ioutils.invoke(path, ['git', 'config', '--unset-all', key])
+        # 5 means the key was not set
+        if ret and ret != 5:
+            logger.error("Could not unset config %s for '%s': %s" % (key, path, err))
+            return
+        for value in values:
+            ret, out, err = ioutils.invoke(path, ['git', 'config', '--add', key, value])
+            if ret:
+                logger.error("Could not add config %s=%s for '%s': %s" %
+                             (key, value, path, err))
+
+    @classmethod
+    def get_conf_list(cls, path):
+        '''Returns all the keys set in the repo config as (key, value) pairs,
+        in the order they appear in the config.'''
+        ret, out, err = ioutils.invoke(path, ['git', 'config', '--local', '--includes',
+                                              '--list', '-z'])
+        if ret:
+            logger.warn("Could not list config for '%s': %s" % (path, err))
+            return []
+
+        val = []
+        for entry in out.split('\0'):
+            if entry:
+                # keys without a value are boolean true
+                key, _, value = entry.partition('\n')
+                val.append((key, value))
+        return val
+
     @classmethod
     def get_remotes(cls, path):
         ret, out, err = ioutils.invoke(path, ['git', 'remote'])
@@ -162,9 +267,76 @@ class Git(object):
             val = map(lambda s: re.sub(r'^\s*', '', s), val)
         return val
 
+    @classmethod
+    def get_refs(cls, path):
+        '''Lists local and remote tracking branches in a single call, as
+        tuples of (refname, sha, upstream remote, upstream ref, is head).'''
+        fmt = '%00'.join(['%(refname)', '%(objectname)', '%(upstream:remotename)',
+                          '%(upstream:remoteref)', '%(HEAD)'])
+        args = ['git', 'for-each-ref', '--format=%s' % fmt,
+                'refs/heads', 'refs/remotes']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.warn("Could not get refs for '%s': %s" % (path, err))
+            return []
+
+        val = []
+        for line in out.split('\n'):
+            parts = line.split('\0')
+            if len(parts) == 5:
+                refname, sha, remote, remoteref, head = parts
+                val.append((refname, sha, remote, remoteref, head == '*'))
+        return val
+
+    @classmethod
+    def get_status(cls, path, untracked=True):
+        '''Returns the lines of git status --porcelain=v2 --branch, which
+        holds the checked out branch and every changed file. Listing untracked
+        files means walking the whole working tree, which is skipped if
+        untracked is False.'''
+        # NOTE: --no-optional-locks so that status does not write a refreshed
+        # index, which could make a git command run by the user fail
+        args = ['git', '--no-optional-locks', 'status', '--porcelain=v2', '--branch']
+        if not untracked:
+            args += ['--untracked-files=no']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.warn("Could not get status for '%s': %s" % (path, err))
+            return None
+        return out.split('\n')
+
+    @classmethod
+    def get_tracking(cls, path):
+        '''Lists the local branches as tuples of (branch, upstream, track),
+        where track is eg. "ahead 1, behind 2", or "gone" if the upstream no
+        longer exists.'''
+        fmt = '%00'.join(['%(refname)', '%(upstream:short)',
+                          '%(upstream:track,nobracket)'])
+        args = ['git', 'for-each-ref', '--format=%s' % fmt, 'refs/heads']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.warn("Could not get tracking branches for '%s': %s" % (path, err))
+            return []
+
+        val = []
+        for line in out.split('\n'):
+            parts = line.split('\0')
+            if len(parts) == 3:
+                refname, upstream, track = parts
+                val.append((refname[len('refs/heads/'):], upstream, track))
+        return val
+
+    @classmethod
+    def get_stash_count(cls, path):
+        ret, out, err = ioutils.invoke(path, ['git', 'stash', 'list'])
+        if ret:
+            logger.warn("Could not list stashes for '%s': %s" % (path, err))
+            return 0
+        return len([line for line in out.split('\n') if line])
+
     @classmethod
     def get_branches_remote(cls, path, remote):
-        ret, out, err = ioutils.invoke(path, ['git', 'ls-remote', remote])
+        ret, out, err = cls.network.run(path, 'ls_remote', ['git', 'ls-remote', remote])
         if not out:
             val = []
             logger.warn("Could not get remote branches for '%s': %s" %
@@ -178,6 +350,20 @@ class Git(object):
                     val.append(name)
         return val
 
+    @classmethod
+    def get_remote_head(cls, path, remote):
+        '''Returns the default branch of the remote, that its HEAD points to.'''
+        args = ['git', 'ls-remote', '--symref', remote, 'HEAD']
+        ret, out, err = cls.network.run(path, 'ls_remote', args)
+        if ret:
+            logger.warn("Could not get the default branch of %s for '%s': %s" %
+                        (remote, path, err))
+            return None
+
+        m = re.search(r'^ref: refs/heads/(\S+)\s+HEAD$', out, re.M)
+        if m:
+            return m.group(1)
+
     @classmethod
     def remove_local_branch(cls, path, branch):
         ret, out, err = ioutils.invoke(path, ['git', 'branch', '-D', branch])
@@ -193,16 +379,6 @@ class Git(object):
             logger.error("Could not remove remote tracking branch %s/%s for '%s': %s" %
                          (remote, branch, path, err))
 
-    @classmethod
-    def add_local_tracking_branch(cls, path, remote, branch):
-        arg = '%s/%s' % (remote, branch)
-        ret, out, err = ioutils.invoke(path, ['git', 'branch', '--track', branch, arg])
-        if ret:
-            logger.error("Could not add local tracking branch %s for '%s': %s" %
-                         (branch, path, err))
-        else:
-            return True
-
     @classmethod
     def add_remote(cls, path, name, url):
         ret, out, err = ioutils.invoke(path, ['git', 'remote', 'add', name, url])
@@ -213,20 +389,81 @@ class Git(object):
     @classmethod
     def clone(cls, path, url):
         os.mkdir(path)
-        ret, out, err = ioutils.invoke(path, ['git', 'clone', url, '.'])
+
+        def clear():
+            # a clone that was killed leaves a partial checkout behind
+            for name in os.listdir(path):
+                filepath = os.path.join(path, name)
+                if os.path.isdir(filepath) and not os.path.islink(filepath):
+                    shutil.rmtree(filepath)
+                else:
+                    os.remove(filepath)
+
+        ret, out, err = cls.network.run(path, 'clone', ['git', 'clone', url, '.'],
+                                        before_retry=clear)
         if ret:
             logger.error("Clone error for '%s': %s" % (path, err))
         else:
             return True
 
     @classmethod
-    def fetch(cls, path, name):
-        ret, out, err = ioutils.invoke(path, ['git', 'fetch', '--prune', name])
+    def fetch_args(cls, name, depth=None, filter_spec=None):
+        args = ['git', 'fetch', '--prune']
+        if depth:
+            args += ['--depth=%s' % depth]
+        # the first fetch with a filter makes the remote a promisor remote,
+        # which later fetches the missing objects from on demand
+        if filter_spec:
+            args += ['--filter=%s' % filter_spec]
+        return args + [name]
+
+    @classmethod
+    def fetch(cls, path, name, depth=None, filter_spec=None):
+        args = cls.fetch_args(name, depth=depth, filter_spec=filter_spec)
+        ret, out, err = cls.network.run(path, 'fetch', args)
         if ret:
             logger.error("Fetch error for '%s' from %s: %s" % (path, name, err))
         else:
             return True
 
+    @classmethod
+    def update_ref(cls, path, ref, new, old, reason):
+        ret, out, err = ioutils.invoke(path, ['git', 'update-ref', '-m', reason,
+                                              ref, new, old])
+        if ret:
+            logger.error("Could not update ref %s to %s for '%s': %s" %
+                         (ref, new, path, err))
+        else:
+            return True
+
+    @classmethod
+    def update_refs(cls, path, updates, reason):
+        '''Applies (ref, new, old) updates in a single transaction: either
+        every ref is updated or none is. An old of None means the ref must
+        not exist yet.'''
+        lines = []
+        for ref, new, old in updates:
+            if old is None:
+                lines.append('create %s %s\n' % (ref, new))
+            else:
+                lines.append('update %s %s %s\n' % (ref, new, old))
+        ret, out, err = ioutils.invoke(path, ['git', 'update-ref', '-m', reason, '--stdin'],
+                                       input=''.join(lines))
+        if ret:
+            logger.error("Could not update refs for '%s': %s" % (path, err))
+        else:
+            return True
+
+    @classmethod
+    def fetch_local_args(cls, source, refspecs, tag_option=None):
+        '''Fetches from another repo on disk, eg. the remote tracking branches
+        of a remote in another repo, as if they had been fetched from the
+        remote itself.'''
+        args = ['git', 'fetch', '--prune']
+        if tag_option:
+            args += [tag_option]
+        return args + [source] + refspecs
+
     @classmethod
     def merge(cls, path, branch):
         ret, out, err = ioutils.invoke(path, ['git', 'merge', branch])
@@ -254,17 +491,80 @@ class Git(object):
             return True
 
     @classmethod
-    def check_compactness_local(cls, path):
-        ret, out, err = ioutils.invoke(path, ['git', 'count-objects'])
+    def count_objects(cls, path):
+        '''Returns the stats of git count-objects -v as a dict of ints, sizes
+        are in KiB.'''
+        ret, out, err = ioutils.invoke(path, ['git', 'count-objects', '-v'])
         if ret:
-            logger.warn("Failed checking compactness for '%s': %s" % (path, err))
-        else:
-            if out.startswith('0 objects'):
-                return True, out
-            return False, out
+            logger.warn("Failed counting objects for '%s': %s" % (path, err))
+            return None
+
+        val = {}
+        for line in out.split('\n'):
+            key, _, value = line.partition(':')
+            try:
+                val[key.strip()] = int(value.strip())
+            except ValueError:
+                pass
+        return val
 
     @classmethod
-    def compact_local(cls, path):
-        ret, out, err = ioutils.invoke(path, ['git', 'gc'])
+    def _git_with_threads(cls, threads):
+        args = ['git']
+        # bound the number of threads used for delta compression, so that
+        # concurrent compactions share the cpus between them
+        if threads:
+            args += ['-c', 'pack.threads=%s' % threads]
+        return args
+
+    @classmethod
+    def compact_local(cls, path, threads=None):
+        args = cls._git_with_threads(threads) + ['gc']
+        ret, out, err = ioutils.invoke(path, args)
         if ret:
             logger.error("Compact error for '%s': %s" % (path, err))
+            return False
+        return True
+
+    @classmethod
+    def repack(cls, path, geometric=False, threads=None):
+        '''Without geometric, packs only the loose objects into a new pack.
+        With geometric, also merges the smaller packs so that pack sizes
+        form a geometric progression, leaving the big packs alone.'''
+        args = cls._git_with_threads(threads) + ['repack', '-d', '-q']
+        if geometric:
+            args += ['--geometric=2']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.error("Repack error for '%s': %s" % (path, err))
+            return False
+        return True
+
+    @classmethod
+    def repack_all(cls, path):
+        '''Packs every object reachable in the repo into a single pack,
+        including objects borrowed from alternates, like clone --dissociate.'''
+        ret, out, err = ioutils.invoke(path, ['git', 'repack', '-a', '-d', '-q'])
+        if ret:
+            logger.error("Repack error for '%s': %s" % (path, err))
+            return False
+        return True
+
+    @classmethod
+    def prune(cls, path, expire=None):
+        '''Removes unreachable loose objects, and temporary files left in the
+        object store, that are older than expire (like gc.pruneExpire).'''
+        args = ['git', 'prune', '--expire', expire or '2.weeks.ago']
+        ret, out, err = ioutils.invoke(path, args)
+        if ret:
+            logger.error("Prune error for '%s': %s" % (path, err))
+            return False
+        return True
+
+    @classmethod
+    def prune_packed(cls, path):
+        ret, out, err = ioutils.invoke(path, ['git', 'prune-packed', '-q'])
+        if ret:
+            logger.error("Prune error for '%s': %s" % (path, err))
+            return False
+        return True
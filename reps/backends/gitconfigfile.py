@@ -0,0 +1,247 @@
+from __future__ import absolute_import
+
+import io
+import logging
+import os
+import re
+
+logger = logging
+
+
+class UnsupportedConfig(Exception):
+    pass
+
+
+class GitConfigFile(object):
+    '''Reads the config of a repo straight from the files under .git, giving
+    the same result as git config --local --list. Returns None for configs
+    it does not handle (conditional includes), in which case the caller
+    should ask git.'''
+
+    max_include_depth = 10
+
+    key_re = re.compile(r'[A-Za-z][A-Za-z0-9-]*')
+    section_re = re.compile(r'\[\s*([A-Za-z0-9.-]+)\s*(?:"((?:[^"\\\n]|\\.)*)")?\s*\]')
+
+    escapes = {
+        'n': '\n',
+        't': '\t',
+        'b': '\b',
+        '"': '"',
+        '\\': '\\',
+    }
+
+    @classmethod
+    def find_gitdir(cls, path):
+        '''Returns the git dir of a checkout, following a .git file as used
+        by linked worktrees and submodules.'''
+        dotgit = os.path.join(path, '.git')
+        if os.path.isdir(dotgit):
+            return dotgit
+
+        try:
+            with open(dotgit) as fp:
+                line = fp.readline().strip()
+        except (IOError, OSError):
+            return None
+
+        m = re.match(r'^gitdir:\s*(.*)$', line)
+        if m:
+            gitdir = m.group(1)
+            if not os.path.isabs(gitdir):
+                gitdir = os.path.join(path, gitdir)
+            return os.path.normpath(gitdir)
+
+    @classmethod
+    def find_commondir(cls, gitdir):
+        '''Linked worktrees share the config of the main repo.'''
+        try:
+            with open(os.path.join(gitdir, 'commondir')) as fp:
+                commondir = fp.readline().strip()
+        except (IOError, OSError):
+            return gitdir
+
+        if not os.path.isabs(commondir):
+            commondir = os.path.join(gitdir, commondir)
+        return os.path.normpath(commondir)
+
+    @classmethod
+    def read_repo_config(cls, path):
+        gitdir = cls.find_gitdir(path)
+        if not gitdir:
+            return None
+
+        commondir = cls.find_commondir(gitdir)
+        try:
+            pairs = cls.parse(os.path.join(commondir, 'config'))
+
+            # per worktree config is only read if the extension is enabled
+            for key, value in pairs:
+                if key == 'extensions.worktreeconfig' and cls.is_true(value):
+                    filepath = os.path.join(gitdir, 'config.worktree')
+                    if os.path.exists(filepath):
+                        pairs += cls.parse(filepath)
+                    break
+
+        except (IOError, OSError, UnsupportedConfig) as e:
+            logger.debug("Not parsing config for '%s': %s" % (path, e))
+            return None
+
+        return pairs
+
+    @classmethod
+    def is_true(cls, value):
+        return value.lower() in ('', 'true', 'yes', 'on', '1')
+
+    @classmethod
+    def parse(cls, filepath, depth=0):
+        if depth > cls.max_include_depth:
+            raise UnsupportedConfig('Includes nested too deeply: %s' % filepath)
+
+        with io.open(filepath, encoding='utf-8', errors='replace') as fp:
+            text = fp.read()
+        if text.startswith(u'\ufeff'):
+            text = text[1:]
+
+        pairs = []
+        for key, value in cls.parse_text(text):
+            pairs.append((key, value))
+
+            if key == 'include.path':
+                incpath = os.path.expanduser(value)
+                if not os.path.isabs(incpath):
+                    incpath = os.path.join(os.path.dirname(filepath), incpath)
+                # missing include files are ignored by git
+                if os.path.exists(incpath):
+                    pairs.extend(cls.parse(incpath, depth=depth + 1))
+
+            elif key.startswith('includeif.'):
+                raise UnsupportedConfig('Conditional include: %s' % key)
+
+        return pairs
+
+    @classmethod
+    def parse_text(cls, text):
+        section = None
+        pos = 0
+        length = len(text)
+
+        while pos < length:
+            c = text[pos]
+
+            if c in ' \t\r\n':
+                pos += 1
+
+            elif c in '#;':
+                pos = cls.skip_line(text, pos)
+
+            elif c == '[':
+                section, pos = cls.parse_section(text, pos)
+
+            elif c.isalpha():
+                if section is None:
+                    raise UnsupportedConfig('Key outside of section')
+                # isalpha also holds for letters outside of ascii, which
+                # git does not allow in a key
+                m = cls.key_re.match(text, pos)
+                if not m:
+                    raise UnsupportedConfig('Bad key at: %r' % c)
+                name = m.group(0).lower()
+                pos = m.end()
+
+                # skip blanks up to either = or the end of the line
+                while pos < length and text[pos] in ' \t':
+                    pos += 1
+                if pos < length and text[pos] == '=':
+                    value, pos = cls.parse_value(text, pos + 1)
+                elif pos >= length or text[pos] in '\r\n#;':
+                    value = ''
+                    pos = cls.skip_line(text, pos)
+                else:
+                    raise UnsupportedConfig('Bad key: %s' % name)
+
+                yield '%s.%s' % (section, name), value
+
+            else:
+                raise UnsupportedConfig('Unexpected character: %r' % c)
+
+    @classmethod
+    def skip_line(cls, text, pos):
+        end = text.find('\n', pos)
+        if end < 0:
+            return len(text)
+        return end + 1
+
+    @classmethod
+    def parse_section(cls, text, pos):
+        m = cls.section_re.match(text, pos)
+        if not m:
+            raise UnsupportedConfig('Bad section header')
+
+        name, subsection = m.group(1), m.group(2)
+        if subsection is not None:
+            subsection = re.sub(r'\\(.)', r'\1', subsection)
+            section = '%s.%s' % (name.lower(), subsection)
+        else:
+            # also the deprecated [section.subsection] syntax, which is
+            # lowercased as a whole
+            section = name.lower()
+        return section, m.end()
+
+    @classmethod
+    def parse_value(cls, text, pos):
+        length = len(text)
+        value = []
+        quoted = False
+        # whitespace is only kept between other characters
+        pending_space = ''
+
+        while pos < length:
+            c = text[pos]
+
+            if c == '\n':
+                pos += 1
+                break
+
+            elif c == '\r' and text[pos + 1:pos + 2] == '\n':
+                pos += 1
+
+            elif not quoted and c in '#;':
+                pos = cls.skip_line(text, pos)
+                break
+
+            elif c == '"':
+                quoted = not quoted
+                value.append(pending_space)
+                pending_space = ''
+                pos += 1
+
+            elif c == '\\':
+                nxt = text[pos + 1:pos + 2]
+                if nxt == '\n':
+                    pos += 2
+                elif nxt == '\r' and text[pos + 2:pos + 3] == '\n':
+                    pos += 3
+                elif nxt in cls.escapes:
+                    value.append(pending_space)
+                    pending_space = ''
+                    value.append(cls.escapes[nxt])
+                    pos += 2
+                else:
+                    raise UnsupportedConfig('Bad escape: \\%s' % nxt)
+
+            elif not quoted and c in ' \t':
+                if value:
+                    pending_space += c
+                pos += 1
+
+            else:
+                value.append(pending_space)
+                pending_space = ''
+                value.append(c)
+                pos += 1
+
+        if quoted:
+            raise UnsupportedConfig('Unterminated quote')
+
+        return ''.join(value), pos
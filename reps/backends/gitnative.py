@@ -0,0 +1,367 @@
+from __future__ import absolute_import
+
+import errno
+import io
+import logging
+import os
+import re
+import stat
+
+from reps.backends.git import Git
+from reps.backends.gitconfigfile import GitConfigFile
+
+logger = logging
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+class GitNative(Git):
+    '''Answers read-only queries about HEAD, refs and config by reading the
+    files under .git, instead of running git. Config keys are written to
+    the config file directly. Repos with a layout it does not handle
+    (reftable, linked worktrees) are left to the git subprocess.'''
+
+    sha_pattern = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+    max_symref_depth = 5
+
+    local_prefix = 'refs/heads/'
+    remote_prefix = 'refs/remotes/'
+
+    @classmethod
+    def get_gitdir(cls, path):
+        gitdir = os.path.join(path, '.git')
+        if not os.path.isdir(gitdir):
+            raise UnsupportedLayout('No .git directory')
+        # a linked worktree keeps its refs in the main repo
+        if os.path.exists(os.path.join(gitdir, 'commondir')):
+            raise UnsupportedLayout('Linked worktree')
+        if os.path.exists(os.path.join(gitdir, 'reftable')):
+            raise UnsupportedLayout('Refs stored as reftable')
+        return gitdir
+
+    @classmethod
+    def read_head(cls, gitdir):
+        '''Returns the branch HEAD points to, or the commit if detached.'''
+        with open(os.path.join(gitdir, 'HEAD')) as fp:
+            head = fp.read().strip()
+
+        if head.startswith('ref: '):
+            return head[len('ref: '):], None
+        if cls.sha_pattern.match(head):
+            return None, head
+        raise UnsupportedLayout('Bad HEAD: %s' % head)
+
+    @classmethod
+    def read_packed_refs(cls, gitdir):
+        refs = {}
+        try:
+            with open(os.path.join(gitdir, 'packed-refs')) as fp:
+                lines = fp.readlines()
+        except (IOError, OSError):
+            return refs
+
+        for line in lines:
+            line = line.strip()
+            # skip the header, and the peeled value of annotated tags
+            if not line or line.startswith('#') or line.startswith('^'):
+                continue
+            sha, _, refname = line.partition(' ')
+            if not cls.sha_pattern.match(sha):
+                raise UnsupportedLayout('Bad packed ref: %s' % line)
+            refs[refname] = sha
+        return refs
+
+    @classmethod
+    def read_loose_refs(cls, gitdir, prefix):
+        '''Returns the loose refs under prefix, as a dict of refname to
+        either a sha or a ref: <target> string for symbolic refs.'''
+        refs = {}
+        top = os.path.join(gitdir, *prefix.split('/'))
+        for dirpath, dirs, files in os.walk(top):
+            for name in files:
+                if name.endswith('.lock'):
+                    continue
+                filepath = os.path.join(dirpath, name)
+                relpath = os.path.relpath(filepath, gitdir)
+                refname = '/'.join(relpath.split(os.sep))
+                with open(filepath) as fp:
+                    refs[refname] = fp.read().strip()
+        return refs
+
+    @classmethod
+    def read_refs(cls, gitdir, prefixes):
+        '''Returns the refs under the prefixes as a dict of refname to
+        (sha, symref target), loose refs taking precedence over packed.'''
+        packed = cls.read_packed_refs(gitdir)
+        raw = {}
+        for refname, sha in packed.items():
+            for prefix in prefixes:
+                if refname.startswith(prefix + '/'):
+                    raw[refname] = sha
+        for prefix in prefixes:
+            raw.update(cls.read_loose_refs(gitdir, prefix))
+
+        def resolve(value, depth=0):
+            if depth > cls.max_symref_depth:
+                raise UnsupportedLayout('Symbolic refs nested too deeply')
+            if value.startswith('ref: '):
+                target = value[len('ref: '):]
+                if target in raw:
+                    return resolve(raw[target], depth + 1)
+                if target in packed:
+                    return packed[target]
+                return None
+            if not cls.sha_pattern.match(value):
+                raise UnsupportedLayout('Bad ref: %s' % value)
+            return value
+
+        refs = {}
+        for refname, value in raw.items():
+            target = None
+            if value.startswith('ref: '):
+                target = value[len('ref: '):]
+            sha = resolve(value)
+            if sha:
+                refs[refname] = (sha, target)
+        return refs
+
+    @classmethod
+    def fmt_conf_value(cls, value):
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"')
+                   .replace('\n', '\\n').replace('\t', '\\t'))
+        if escaped != value or value != value.strip() or re.search(r'[#;]', value):
+            return '"%s"' % escaped
+        return value
+
+    @classmethod
+    def normalize_conf_key(cls, key):
+        section, _, rest = key.partition('.')
+        subsection, _, var = rest.rpartition('.')
+        if subsection:
+            return '%s.%s.%s' % (section.lower(), subsection, var.lower())
+        return '%s.%s' % (section.lower(), var.lower())
+
+    @classmethod
+    def parse_conf_lines(cls, text):
+        '''Returns the lines of a config file as (section, key, line), where
+        key is the normalized key a line sets, or None. Values continued on
+        the next line are left to git.'''
+        section = None
+        entries = []
+        for line in text.splitlines(True):
+            stripped = line.strip()
+            key = None
+            if stripped.startswith('['):
+                m = re.match(r'^\[\s*([A-Za-z0-9.-]+)\s*(?:"((?:[^"\\]|\\.)*)")?\s*\]'
+                             r'\s*(?:[#;].*)?$', stripped)
+                if not m:
+                    raise UnsupportedLayout('Unsupported section line: %s' % stripped)
+                name, subsection = m.group(1), m.group(2)
+                section = name.lower()
+                if subsection is not None:
+                    section = '%s.%s' % (section, re.sub(r'\\(.)', r'\1', subsection))
+
+            elif section and re.match(r'^[A-Za-z]', stripped):
+                if stripped.endswith('\\'):
+                    raise UnsupportedLayout('Continued value: %s' % stripped)
+                var = re.match(r'^[A-Za-z][A-Za-z0-9-]*', stripped).group(0)
+                key = cls.normalize_conf_key('%s.%s' % (section, var))
+
+            entries.append((section, key, line))
+        return entries
+
+    @classmethod
+    def fmt_conf_header(cls, key):
+        section, _, rest = key.partition('.')
+        subsection = rest.rpartition('.')[0]
+        if '\n' in subsection:
+            raise UnsupportedLayout('Bad config key: %s' % key)
+        if subsection:
+            subsection = subsection.replace('\\', '\\\\').replace('"', '\\"')
+            return '[%s "%s"]\n' % (section, subsection)
+        return '[%s]\n' % section
+
+    @classmethod
+    def update_conf_text(cls, text, pairs):
+        '''Sets keys in the text of a config file like git config does: a
+        key that is set is replaced where it is, a new key goes at the end of
+        its section, or in a new section at the end of the file.'''
+        entries = cls.parse_conf_lines(text)
+        if entries and not entries[-1][2].endswith('\n'):
+            section, key, line = entries[-1]
+            entries[-1] = (section, key, line + '\n')
+
+        for key, value in pairs:
+            var = key.rpartition('.')[2]
+            if not re.match(r'^[A-Za-z][A-Za-z0-9-]*$', var):
+                raise UnsupportedLayout('Bad config key: %s' % key)
+            nkey = cls.normalize_conf_key(key)
+            section = nkey.rpartition('.')[0]
+            line = '\t%s = %s\n' % (var, cls.fmt_conf_value(value))
+
+            found = [i for i, entry in enumerate(entries) if entry[1] == nkey]
+            if found:
+                entries[found[-1]] = (section, nkey, line)
+                # a key set more than once ends up with the one value
+                for i in reversed(found[:-1]):
+                    del entries[i]
+                continue
+
+            in_section = [i for i, entry in enumerate(entries) if entry[0] == section]
+            if in_section:
+                # after the last key or the header, before blank lines and
+                # comments
+                pos = in_section[-1]
+                while entries[pos][1] is None and not entries[pos][2].strip().startswith('['):
+                    pos -= 1
+                entries.insert(pos + 1, (section, nkey, line))
+            else:
+                entries.append((section, None, cls.fmt_conf_header(key)))
+                entries.append((section, nkey, line))
+
+        return ''.join(line for section, key, line in entries)
+
+    @classmethod
+    def native(cls, path, func, fallback):
+        '''Runs func on the git dir of path, or falls back to asking git if
+        the repo is not laid out in a way we can read.'''
+        try:
+            gitdir = cls.get_gitdir(path)
+            return func(gitdir)
+        except (IOError, OSError, UnsupportedLayout) as e:
+            logger.debug("Falling back to git for '%s': %s" % (path, e))
+            return fallback(path)
+
+    ### Overrides
+
+    @classmethod
+    def get_conf_list(cls, path):
+        pairs = GitConfigFile.read_repo_config(path)
+        if pairs is None:
+            return super(GitNative, cls).get_conf_list(path)
+        return pairs
+
+    @classmethod
+    def set_conf_keys(cls, path, pairs):
+        def func(gitdir):
+            # the same lock git takes, then a rename, so that a reader never
+            # sees a partly written config
+            filepath = os.path.join(gitdir, 'config')
+            lockpath = '%s.lock' % filepath
+            try:
+                fd = os.open(lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    raise UnsupportedLayout('Config is locked')
+                raise
+
+            try:
+                with io.open(filepath, encoding='utf-8') as fp:
+                    text = fp.read()
+                text = cls.update_conf_text(text, pairs)
+
+                with io.open(fd, 'w', encoding='utf-8') as fp:
+                    fp.write(text)
+                os.chmod(lockpath, stat.S_IMODE(os.stat(filepath).st_mode))
+                # rename does not replace an existing file on windows
+                getattr(os, 'replace', os.rename)(lockpath, filepath)
+            except BaseException:
+                os.unlink(lockpath)
+                raise
+
+        def fallback(path):
+            return super(GitNative, cls).set_conf_keys(path, pairs)
+
+        return cls.native(path, func, fallback)
+
+    @classmethod
+    def get_checked_out_commit(cls, path):
+        def func(gitdir):
+            branch, commit = cls.read_head(gitdir)
+            if commit:
+                return commit
+
+            if branch.startswith(cls.local_prefix):
+                refs = cls.read_refs(gitdir, ['refs/heads'])
+                if branch in refs:
+                    return branch[len(cls.local_prefix):]
+                # an unborn branch, eg. in a freshly initialized repo
+                return None
+
+            raise UnsupportedLayout('HEAD points outside refs/heads: %s' % branch)
+
+        fallback = super(GitNative, cls).get_checked_out_commit
+        return cls.native(path, func, fallback)
+
+    @classmethod
+    def _get_branches_local(cls, path):
+        def func(gitdir):
+            branch, commit = cls.read_head(gitdir)
+            refs = cls.read_refs(gitdir, ['refs/heads'])
+            val = []
+            for refname in sorted(refs):
+                name = refname[len(cls.local_prefix):]
+                val.append((refname == branch, name))
+            return val
+
+        fallback = super(GitNative, cls)._get_branches_local
+        return cls.native(path, func, fallback)
+
+    @classmethod
+    def get_branches_remote_tracking(cls, path):
+        def func(gitdir):
+            refs = cls.read_refs(gitdir, ['refs/remotes'])
+            val = []
+            for refname in sorted(refs):
+                name = refname[len(cls.remote_prefix):]
+                sha, target = refs[refname]
+                # displayed as eg. origin/HEAD -> origin/master
+                if target and target.startswith(cls.remote_prefix):
+                    name = '%s -> %s' % (name, target[len(cls.remote_prefix):])
+                val.append(name)
+            return val
+
+        fallback = super(GitNative, cls).get_branches_remote_tracking
+        return cls.native(path, func, fallback)
+
+    @classmethod
+    def get_refs(cls, path):
+        def func(gitdir):
+            branch, commit = cls.read_head(gitdir)
+            refs = cls.read_refs(gitdir, ['refs/heads', 'refs/remotes'])
+            config = dict(cls.get_conf_list(path))
+
+            val = []
+            for refname in sorted(refs):
+                sha, target = refs[refname]
+                remote, remoteref = '', ''
+                if refname.startswith(cls.local_prefix):
+                    name = refname[len(cls.local_prefix):]
+                    remote = config.get('branch.%s.remote' % name, '')
+                    remoteref = config.get('branch.%s.merge' % name, '')
+                    # git only reports an upstream that is fully configured
+                    if not (remote and remoteref):
+                        remote, remoteref = '', ''
+                val.append((refname, sha, remote, remoteref, refname == branch))
+            return val
+
+        fallback = super(GitNative, cls).get_refs
+        return cls.native(path, func, fallback)
+
+    @classmethod
+    def get_stash_count(cls, path):
+        def func(gitdir):
+            # every stash is an entry in the reflog of refs/stash
+            try:
+                with open(os.path.join(gitdir, 'logs', 'refs', 'stash')) as fp:
+                    return len([line for line in fp if line.strip()])
+            except (IOError, OSError):
+                if 'refs/stash' in cls.read_packed_refs(gitdir) or \
+                   os.path.exists(os.path.join(gitdir, 'refs', 'stash')):
+                    raise UnsupportedLayout('Stash without a reflog')
+                return 0
+
+        fallback = super(GitNative, cls).get_stash_count
+        return cls.native(path, func, fallback)
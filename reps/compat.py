@@ -2,3 +2,18 @@ try:
     from collections import OrderedDict  # noqa
 except ImportError:
     from ordereddict import OrderedDict  # noqa
+
+try:
+    import queue  # noqa
+except ImportError:
+    import Queue as queue  # noqa
+
+try:
+    from os import scandir  # noqa
+except ImportError:
+    scandir = None
+
+try:
+    import fcntl  # noqa
+except ImportError:
+    fcntl = None
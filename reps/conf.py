@@ -1,10 +1,10 @@
 from __future__ import absolute_import
 
 import os
-import re
 import string
 
-from reps.compat import OrderedDict
+from reps import consts
+from reps.confindex import ConfIndex
 from reps.model import RepoManager
 
 
@@ -12,6 +12,11 @@ class Conf(object):
     @classmethod
     def write_config(cls, repo_manager, filepath=None, filehandle=None):
         ss = []
+        if repo_manager.settings:
+            ss.append('[%s]' % consts.SETTINGS_SECTION)
+            for k, v in repo_manager.settings.items():
+                ss.append('    %s = %s' % (k, v))
+
         for repo_name, repo in sorted(repo_manager.items()):
             ss.append('[%s]' % repo_name)
             for k, v in repo.attributes_to_cfg():
@@ -25,24 +30,17 @@ class Conf(object):
                 fp.write(s.encode())
 
     @classmethod
-    def read_config(cls, filepath):
-        lines = open(filepath).readlines()
-        repo_manager = RepoManager()
-
-        dct = OrderedDict()
-        cur_section = None
-        for line in lines:
-            if line.startswith('['):
-                section = re.findall(r'^\[(.*?)\]$', line)[0]
-                cur_section = section.strip()
-            elif line.startswith(' '):
-                key, val = re.findall(r'^[ ]{4}([^ ]+)\s*=\s*([^ ]+)$', line)[0]
-                if not cur_section in dct:
-                    dct[cur_section] = OrderedDict()
-                dct[cur_section][key.strip()] = val.strip()
-
-        for section, d in dct.items():
-            repo_manager.add_repo(section, d)
+    def read_config(cls, filepath, root=None):
+        '''Repos are only built from their sections once they are used, see
+        RepoManager.add_repo.'''
+        index = ConfIndex.load(filepath)
+        repo_manager = RepoManager(root=root)
+
+        for section, d in index.sections.items():
+            if section == consts.SETTINGS_SECTION:
+                repo_manager.settings.update(d)
+            else:
+                repo_manager.add_repo(section, d)
         return repo_manager
 
 class LocalConf(object):
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+
+import io
+import logging
+import os
+
+from reps.compat import OrderedDict
+
+logger = logging
+
+
+class ConfIndex(object):
+    '''The sections of a config and their attributes, read from the config
+    and the files it includes.'''
+
+    include_directive = 'include '
+
+    def __init__(self):
+        self.sections = OrderedDict()  # section -> OrderedDict of attributes
+        self.files = []                # the files read, in order
+
+    @classmethod
+    def load(cls, filepath):
+        index = cls()
+        index.parse(filepath)
+        return index
+
+    def parse(self, filepath):
+        '''Reads the sections of a config. A line of the form include <path>
+        reads the sections of another file, relative to the including one.'''
+        filepath = os.path.abspath(filepath)
+        if filepath in self.files:
+            logger.warn('Not including %s again' % filepath)
+            return
+
+        with io.open(filepath, encoding='utf-8') as fp:
+            lines = fp.readlines()
+        self.files.append(filepath)
+
+        section = None
+        for line in lines:
+            if line.startswith('['):
+                end = line.find(']')
+                if end > 0:
+                    section = line[1:end].strip()
+
+            elif line.startswith(' '):
+                key, sep, val = line.partition('=')
+                if sep and section is not None:
+                    attributes = self.sections.setdefault(section, OrderedDict())
+                    attributes[key.strip()] = val.strip()
+
+            elif line.startswith(self.include_directive):
+                incpath = os.path.expanduser(line[len(self.include_directive):].strip())
+                if not os.path.isabs(incpath):
+                    incpath = os.path.join(os.path.dirname(filepath), incpath)
+                self.parse(incpath)
+                section = None
@@ -3,5 +3,51 @@ from __future__ import absolute_import
 
 REPO_CONFIG = '.reconfig'
 REPO_CONFIG_LOCAL = '.reconfig.local'
+REPO_SCAN_CACHE = '.reconfig.scancache'
+SHARED_OBJECTS_DIR = '.reconfig.objects'
 
 CANONICAL_REMOTE = 'origin'
+SETTINGS_SECTION = 'settings'
+
+# directories never searched for workspaces
+SCAN_PRUNED_DIRS = (
+    '.bzr',
+    '.cvs',
+    '.git',
+    '.hg',
+    '.reconfig.objects',
+    '.svn',
+    '.tox',
+    '.venv',
+    '__pycache__',
+    'node_modules',
+)
+
+# number of threads scanning for repos
+SCAN_JOBS = 8
+
+# number of repos queried at once by re status
+STATUS_JOBS = 16
+
+# maximum number of concurrent fetches from the same host
+FETCH_HOST_JOBS = 4
+
+# sections of settings that apply to a whole pull, which with -r are taken
+# from the first workspace
+RUN_WIDE_SETTINGS = ('fetch', 'network', 'pull')
+
+# seconds a mirror fetched from the network stays fresh
+MIRROR_MAX_AGE = 300
+
+# seconds an ssh master connection stays open after its last use
+SSH_CONTROL_PERSIST = 60
+
+# limits for git commands that talk to a remote, times in seconds. There is
+# no hard timeout by default, stalled transfers are caught by the low speed
+# limit
+NETWORK_TIMEOUT = None
+NETWORK_LOW_SPEED_LIMIT = 1000  # bytes/s
+NETWORK_LOW_SPEED_TIME = 60
+NETWORK_RETRIES = 2
+NETWORK_BACKOFF = 2
+SSH_KEEPALIVE = 15
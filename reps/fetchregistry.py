@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+
+import os
+import threading
+
+
+class FetchRegistry(object):
+    '''Remembers the urls fetched from the network during a run, and which
+    repo fetched them. Other repos with a remote on the same url, possibly
+    in another workspace, then fetch from that repo instead of the network.'''
+
+    def __init__(self):
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def get_source(self, url):
+        '''Returns the location of a repo that has fetched url, and the name
+        of its remote for it.'''
+        with self.lock:
+            return self.sources.get(url)
+
+    def add_source(self, url, location, remote_name):
+        with self.lock:
+            self.sources.setdefault(url, (os.path.abspath(location), remote_name))
@@ -1,7 +1,12 @@
 from __future__ import absolute_import
 
 import logging
+import os
+import signal
 import subprocess
+import sys
+import threading
+import time
 
 import ansicolor
 
@@ -13,20 +18,109 @@ try:
 except NameError:
     input_func = input
 
+# output written by a thread can be buffered and flushed as a unit, so that
+# jobs running concurrently do not interleave their output
+_local = threading.local()
+_output_lock = threading.Lock()
+
+
+def start_buffering():
+    _local.buffer = []
+
+def stop_buffering():
+    buf = getattr(_local, 'buffer', None) or []
+    _local.buffer = None
+    return ''.join(buf)
+
+def flush(s):
+    if s:
+        with _output_lock:
+            ansicolor.write_out(s)
+
+def write_out(s):
+    buf = getattr(_local, 'buffer', None)
+    if buf is not None:
+        buf.append(s)
+    else:
+        ansicolor.write_out(s)
+
+
+# when set, every invocation is recorded by the profiler
+_profiler = None
+
+def set_profiler(profiler):
+    global _profiler
+    _profiler = profiler
+
+def record_invocation(cwd, args, start, ret, out_size):
+    if _profiler:
+        _profiler.record(cwd, args, start, time.time() - start, ret, out_size)
+
+
 def maybe_decode(value):
     if type(value) == bytes:
         return value.decode()
     return value
 
 
-def invoke(cwd, args):
+# the return code of a command killed for taking too long, as used by
+# timeout(1)
+TIMED_OUT = 124
+
+def get_session_kwargs(timeout):
+    '''With a timeout, a command runs in a session of its own, so that the
+    timeout kills the processes it started as well (eg. ssh), which would
+    otherwise keep its output open. Such a command cannot prompt on the
+    terminal. preexec_fn is not safe to use from threads, it is only used
+    on python 2, which lacks start_new_session.'''
+    if not (timeout and hasattr(os, 'setsid')):
+        return {}
+    if sys.version_info >= (3, 2):
+        return {'start_new_session': True}
+    return {'preexec_fn': os.setsid}
+
+def kill_session(popen):
+    '''Kills a command started with get_session_kwargs and everything it
+    started.'''
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(popen.pid, signal.SIGKILL)
+        else:
+            popen.kill()
+    except OSError:
+        pass
+
+def invoke(cwd, args, timeout=None, input=None):
     logger.debug("Invoking: [%s] '%s'" % (cwd, ' '.join(args)))
+    start = time.time()
     popen = subprocess.Popen(args, cwd=cwd,
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    (out, err) = popen.communicate()
+                             stdin=input is not None and subprocess.PIPE or None,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             **get_session_kwargs(timeout))
+
+    # a timer rather than communicate(timeout=...), which python 2 lacks
+    timer = None
+    killed = []
+    if timeout:
+        def kill():
+            killed.append(True)
+            kill_session(popen)
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        (out, err) = popen.communicate(input is not None and input.encode('utf-8') or None)
+    finally:
+        if timer:
+            timer.cancel()
+
+    record_invocation(cwd, args, start, popen.returncode, len(out) + len(err))
     out = maybe_decode(out).strip()
     err = maybe_decode(err).strip()
     ret = popen.returncode
+    if killed:
+        ret = TIMED_OUT
+        err = 'Timed out after %ss' % timeout
     if out:
         lines = out.split('\n')
         for line in lines:
@@ -40,23 +134,23 @@ def invoke(cwd, args):
 
 def inform(msg, minor=False, major=False):
     if major:
-        ansicolor.write_out(ansicolor.yellow('>>> %s\n' % msg))
+        write_out(ansicolor.yellow('>>> %s\n' % msg))
     elif minor:
-        ansicolor.write_out(ansicolor.cyan('-> %s\n' % msg))
+        write_out(ansicolor.cyan('-> %s\n' % msg))
     else:
-        ansicolor.write_out(ansicolor.green('> %s\n' % msg))
+        write_out(ansicolor.green('> %s\n' % msg))
 
 def suggest(msg, minor=False):
     if minor:
-        ansicolor.write_out(ansicolor.magenta('-> %s\n' % msg))
+        write_out(ansicolor.magenta('-> %s\n' % msg))
     else:
-        ansicolor.write_out(ansicolor.magenta('> %s\n' % msg))
+        write_out(ansicolor.magenta('> %s\n' % msg))
 
 def complain(msg, minor=False):
     if minor:
-        ansicolor.write_out(ansicolor.yellow('-> %s\n' % msg))
+        write_out(ansicolor.yellow('-> %s\n' % msg))
     else:
-        ansicolor.write_out(ansicolor.yellow('> %s\n' % msg))
+        write_out(ansicolor.yellow('> %s\n' % msg))
 
 def prompt(msg, minor=False, default_yes=False):
     if default_yes:
@@ -76,4 +170,4 @@ def prompt(msg, minor=False, default_yes=False):
         return True if 'y' in inp else False
 
 def output(msg):
-    ansicolor.write_out('%s\n' % msg)
+    write_out('%s\n' % msg)
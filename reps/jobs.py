@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+import logging
+import sys
+import threading
+
+from reps import ioutils
+
+logger = logging
+
+
+class JobPool(object):
+    '''Runs a function over a list of items using a bounded number of
+    threads. The output of each job is buffered and printed as a unit once
+    the job finishes, so the output of concurrent jobs does not interleave.
+    With a single job everything runs in the calling thread, unbuffered.
+
+    Jobs can be grouped by key (eg. the host a repo is fetched from), with a
+    separate cap on how many jobs holding the same key run at once.'''
+
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs or 1)
+
+    def map(self, func, items, key=None, key_limit=None):
+        '''key returns the keys of an item, key_limit returns the maximum
+        number of concurrent jobs for a key, or None for no limit.'''
+        items = list(items)
+        if self.jobs == 1 or len(items) < 2:
+            return [func(item) for item in items]
+
+        results = [None] * len(items)
+        errors = []
+        pending = list(enumerate(items))
+        running = {}
+        cond = threading.Condition()
+
+        def keys_of(item):
+            return key and list(key(item)) or []
+
+        def is_runnable(item):
+            for k in keys_of(item):
+                limit = key_limit and key_limit(k)
+                if limit and running.get(k, 0) >= limit:
+                    return False
+            return True
+
+        def next_job():
+            with cond:
+                while pending and not errors:
+                    for i, (idx, item) in enumerate(pending):
+                        if is_runnable(item):
+                            for k in keys_of(item):
+                                running[k] = running.get(k, 0) + 1
+                            return pending.pop(i)
+                    cond.wait()
+
+        def finish_job(item):
+            with cond:
+                for k in keys_of(item):
+                    running[k] -= 1
+                cond.notify_all()
+
+        def worker():
+            while not errors:
+                job = next_job()
+                if job is None:
+                    break
+                idx, item = job
+
+                ioutils.start_buffering()
+                try:
+                    results[idx] = func(item)
+                except Exception:
+                    errors.append(sys.exc_info())
+                finally:
+                    ioutils.flush(ioutils.stop_buffering())
+                    finish_job(item)
+
+        threads = []
+        for _ in range(min(self.jobs, len(items))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # join with a timeout so that the main thread stays responsive to ^C
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+
+        if errors:
+            exc_type, exc_value, tb = errors[0]
+            logger.debug('Job failed', exc_info=errors[0])
+            raise exc_value
+
+        return results
+
+    def walk(self, func, roots):
+        '''Runs func over the roots and, recursively, over the items that
+        func returns, eg. to walk a directory tree.'''
+        if self.jobs == 1:
+            stack = list(reversed(roots))
+            while stack:
+                item = stack.pop()
+                stack.extend(reversed(func(item)))
+            return
+
+        errors = []
+        pending = list(roots)
+        state = {'active': 0}
+        cond = threading.Condition()
+
+        def next_item():
+            with cond:
+                while not errors:
+                    if pending:
+                        state['active'] += 1
+                        return pending.pop()
+                    if not state['active']:
+                        return None
+                    cond.wait()
+
+        def worker():
+            while True:
+                item = next_item()
+                if item is None:
+                    break
+
+                children = []
+                try:
+                    children = func(item)
+                except Exception:
+                    errors.append(sys.exc_info())
+                finally:
+                    with cond:
+                        pending.extend(children)
+                        state['active'] -= 1
+                        cond.notify_all()
+
+        threads = []
+        for _ in range(self.jobs):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+
+        if errors:
+            exc_type, exc_value, tb = errors[0]
+            logger.debug('Job failed', exc_info=errors[0])
+            raise exc_value
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import time
+
+from reps import consts
+from reps.backends import Git
+from reps.compat import fcntl
+from reps.model.gitconfig import ConfigCache
+
+logger = logging
+
+
+class MirrorCache(object):
+    '''A directory of bare mirrors, one per remote url, shared by every
+    workspace on the host. A mirror is fetched from the network at most
+    once per freshness window, and repos then fetch from it locally.
+
+    Updating a mirror holds a lock on it, so that workspaces pulling at the
+    same time wait for the one fetch instead of each doing their own.'''
+
+    def __init__(self, path, max_age=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_age = max_age
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get_str('mirror.dir')
+        if not path:
+            return None
+        return cls(path, max_age=settings.get_int('mirror.max_age', consts.MIRROR_MAX_AGE))
+
+    def get_mirror_path(self, url):
+        # eg. linux-1b2c3d4e5f6a.git for https://github.com/torvalds/linux.git
+        basename = re.sub(r'\.git$', '', url.rstrip('/').rsplit('/', 1)[-1])
+        basename = re.sub(r'[^A-Za-z0-9._-]', '_', basename.rsplit(':', 1)[-1])
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.path, '%s-%s.git' % (basename, digest))
+
+    @classmethod
+    def make_shared_dir(cls, path):
+        '''Creates a directory that everyone in the group can add to, and
+        whose files belong to the same group.'''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            os.chmod(path, 0o2775)
+
+    @contextlib.contextmanager
+    def locked(self, mirror):
+        '''Holds an exclusive lock on the mirror, across processes. The lock
+        is released by the os if the process dies. flock does not need write
+        access, so the lock file of another user can be opened read only.'''
+        fd = os.open('%s.lock' % mirror, os.O_RDONLY | os.O_CREAT, 0o664)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def is_fresh(self, mirror):
+        # git rewrites FETCH_HEAD on every fetch, even if nothing changed
+        try:
+            fetched = os.stat(os.path.join(mirror, 'FETCH_HEAD')).st_mtime
+        except OSError:
+            return False
+        return time.time() - fetched < (self.max_age or 0)
+
+    def init(self, mirror, url):
+        if not os.path.exists(mirror):
+            logger.info('Creating mirror %s of %s' % (mirror, url))
+            self.make_shared_dir(mirror)
+            # other users on the host update the same mirrors
+            if not Git.repo_init_bare(mirror, shared='group'):
+                return False
+
+        ConfigCache(mirror).update([
+            ('remote.origin.url', url),
+            ('remote.origin.fetch', '+refs/heads/*:refs/heads/*'),
+            ('remote.origin.tagOpt', '--tags'),
+        ])
+        return True
+
+    def update(self, url):
+        '''Brings the mirror of url up to date, unless it was fetched within
+        the freshness window. Returns its path, or None if it could not be
+        fetched, in which case the repo should fetch from the remote.'''
+        mirror = self.get_mirror_path(url)
+        try:
+            self.make_shared_dir(self.path)
+            with self.locked(mirror):
+                if self.is_fresh(mirror):
+                    logger.info('Mirror of %s is fresh' % url)
+                    return mirror
+
+                if not (self.init(mirror, url) and Git.fetch(mirror, 'origin')):
+                    return None
+        except (IOError, OSError) as e:
+            logger.warn('Not using mirror %s of %s: %s' % (mirror, url, e))
+            return None
+        return mirror
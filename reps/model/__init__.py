@@ -4,10 +4,12 @@ import logging
 import os
 import re
 
-from reps import consts
 from reps import ioutils
 from reps.compat import OrderedDict
+from reps.jobs import JobPool
 from reps.model.git import GitRepo
+from reps.scancache import ScanCache
+from reps.settings import Settings
 
 logger = logging
 
@@ -23,52 +25,71 @@ VCS_DIRS = (
 class RepoManager(object):
     repotypes = [GitRepo]
 
-    def __init__(self):
-        self.repos = OrderedDict()
+    def __init__(self, root=None):
+        # the workspace root, repo paths are relative to it
+        self.root = root
+        self.repos = OrderedDict()    # path -> repo, None until built
+        self.pending = OrderedDict()  # path -> (repo type, attributes)
+        self.settings = Settings()
 
-    def find_repos(self, cwd, max_depth=None, excluded_dirs=None):
+    def find_repos(self, cwd, max_depth=None, excluded_dirs=None, cache=None,
+                   jobs=1):
         excluded_dirs = excluded_dirs or []
+        cache = cache or ScanCache(root=self.root)
 
-        def clear_list(lst):
-            while True:
-                try:
-                    lst.pop()
-                except IndexError:
-                    break
-
-        def at_location(relpath, dirs, files):
+        def at_location(relpath, dirs, has_marker):
             depth = len(relpath.split(os.sep)) - 1
 
-            for d in dirs:
+            descend = []
+            for d, is_link in dirs:
                 repotype = dispatch.get(d)
                 if repotype:
                     relpath_stripped = re.sub(r'^\./', '', relpath)
-                    repo = repotype.from_checkout(relpath_stripped)
+                    repo = get_repo(repotype, relpath_stripped)
                     if repo.remotes:
                         dct[repo.path] = repo
 
-                # don't traverse vcs dirs
-                if d in VCS_DIRS or d in excluded_dirs:
-                    dirs.remove(d)
+                # don't traverse vcs dirs, or follow symlinks
+                if d in VCS_DIRS or d in excluded_dirs or is_link:
+                    continue
+                descend.append(d)
 
             # reached recursion depth
             if max_depth and max_depth <= depth:
-                clear_list(dirs)
+                descend = []
 
             # reached marker
-            if depth > 0 and consts.REPO_CONFIG in files:
-                clear_list(dirs)
+            if depth > 0 and has_marker:
+                descend = []
+
+            return descend
+
+        def get_repo(repotype, path):
+            location = os.path.join(self.root, path) if self.root else path
+            stamp = repotype.get_checkout_stamp(location)
+            remotes = cache.get_repo(path, stamp)
+            if remotes is not None:
+                return repotype.from_remotes(path, remotes, root=self.root)
+
+            repo = repotype.from_checkout(path, root=self.root)
+            cache.set_repo(path, stamp, repo.remotes_to_list())
+            return repo
 
         dispatch = {}
         for repotype in self.repotypes:
             dispatch[repotype.vcs_dir] = repotype
 
-        dct = {}
-        for relpath, dirs, files in os.walk(cwd):
+        def scan(relpath):
             logger.debug('Scanning %s' % relpath)
-            at_location(relpath, dirs, files)
+            dirs, has_marker = cache.list_dir(relpath)
+            descend = at_location(relpath, dirs, has_marker)
+            return [os.path.join(relpath, d) for d in descend]
+
+        dct = {}
+        JobPool(jobs=jobs).walk(scan, [cwd])
 
         for k in sorted(dct):
+            dct[k].settings = self.settings
             self.repos[k] = dct[k]
 
     def _mk_repo_id(self, vcstag, path):
@@ -81,27 +102,46 @@ class RepoManager(object):
                 return repo_type, m.group(1)
 
     def add_repo(self, repo_id, attributes):
+        # the repo is built on first use, most commands only use a few repos
+        # of a large workspace
         repo_type, path = self._split_repo_id(repo_id)
-        repo = repo_type.from_cfg_attributes(path, attributes)
-        self.repos[path] = repo
+        self.repos[path] = None
+        self.pending[path] = (repo_type, attributes)
+
+    def get_repo(self, path):
+        repo = self.repos.get(path)
+        if repo is None and path in self.pending:
+            repo_type, attributes = self.pending.pop(path)
+            repo = repo_type.from_cfg_attributes(path, attributes, root=self.root)
+            repo.settings = self.settings
+            self.repos[path] = repo
+        return repo
 
     def activate(self, paths):
         for path in paths:
             if path in self.repos:
-                self.repos[path].is_active = True
+                self.get_repo(path).is_active = True
             else:
                 ioutils.complain("Skipping unknown repo: %s" % path)
 
     def activate_all(self):
-        for _, repo in self.repos.items():
-            repo.is_active = True
+        for path in list(self.repos):
+            self.get_repo(path).is_active = True
 
     def items(self):
-        for path, repo in self.repos.items():
+        for path in list(self.repos):
+            repo = self.get_repo(path)
             repo_id = self._mk_repo_id(repo.vcs_tag, path)
             yield repo_id, repo
 
+    def copy_options(self, other):
+        '''Carries over the options of the repos that are also in other, as
+        read from the config.'''
+        for path, repo in self.repos.items():
+            if repo is not None and path in other.repos:
+                repo.copy_options(other.get_repo(path))
+
     def active_repos(self):
         for _, repo in self.repos.items():
-            if repo.is_active:
+            if repo is not None and repo.is_active:
                 yield repo
@@ -1,13 +1,20 @@
 from __future__ import absolute_import
 
+import fnmatch
 import logging
 import os
+import re
 
 from reps import ioutils
 from reps import utils
 from reps.backends import Git
 from reps.consts import CANONICAL_REMOTE
+from reps.model.gitcompact import CompactAction, CompactPolicy
+from reps.model.gitconfig import ConfigCache
+from reps.model.gitrefs import RefSnapshot
+from reps.model.gitstatus import RepoStatus
 from reps.model.gitstrings import StrFmt
+from reps.settings import Settings
 
 logger = logging
 
@@ -61,12 +68,10 @@ class BranchLocal(Branch):
         self.tracking = None
 
     def detect_tracking(self):
-        remote_pointer = StrFmt.fmt_branch_remote_pointer(self.name)
-        merge_pointer = StrFmt.fmt_branch_merge_pointer(self.name)
-        rem_name = Git.get_conf_key(self.repo.path, remote_pointer)
-        longname = Git.get_conf_key(self.repo.path, merge_pointer)
+        upstream = self.repo.get_refs().get_upstream(self.name)
 
-        if rem_name and longname:
+        if upstream:
+            rem_name, longname = upstream
             _, _, br_name = StrFmt.split_branch_longname(longname, parts=3)
 
             remote = Remote.get_remote(self.repo, rem_name)
@@ -80,51 +85,130 @@ class BranchLocal(Branch):
                         (self.name, rem_name, br_name))
 
     def check_exists(self):
-        found = False
-        for name in Git.get_branches_local(self.repo.path):
-            if self.name == name:
-                found = True
-        self.exists = found
+        self.exists = self.repo.get_refs().has_local(self.name)
+
+    def follows_upstream(self):
+        '''Whether the branch is kept up to date with its upstream, unless the
+        branch filters of the remote leave the upstream out.'''
+        return bool(self.tracking) and self.tracking.remote.wants_branch(self.tracking.name)
 
     def is_checked_out(self):
-        return self.name == Git.get_checked_out_commit(self.repo.path)
+        return self.name == self.repo.get_checked_out()
 
     @classmethod
     def cmd_add_tracking(cls, repo, track_branch):
-        if Git.add_local_tracking_branch(repo.path, track_branch.remote.name,
-                                         track_branch.name):
-            branch = cls.get_branch(repo, track_branch.name)
-            branch.tracking = track_branch
+        cls.cmd_add_tracking_all(repo, [track_branch])
+
+    @classmethod
+    def cmd_add_tracking_all(cls, repo, track_branches):
+        '''Creates a local branch tracking each of track_branches. The
+        branches are created in a single ref transaction, so either all of
+        them are created or none, and their upstreams are set in a single
+        config write.'''
+        if not track_branches:
+            return
+
+        refs = repo.get_refs()
+        updates = []
+        for track_branch in track_branches:
+            longname = StrFmt.fmt_branch_remote_tracking(track_branch.remote.name,
+                                                         track_branch.name)
+            tip = refs.get_remote_tracking_tip(longname) or 'refs/remotes/%s' % longname
+            updates.append((StrFmt.fmt_branch_longname(track_branch.name), tip, None))
+        added = Git.update_refs(repo.location, updates, 'branch: Created by re')
+        repo.invalidate_refs()
+        # HEAD may point at a branch, in a repo that was just initialized
+        repo.invalidate_worktree()
+        if added:
+            cls.cmd_set_tracking_all(repo, track_branches)
+            for track_branch in track_branches:
+                branch = cls.get_branch(repo, track_branch.name)
+                branch.tracking = track_branch
 
     def cmd_set_tracking(self, track_branch):
-        remote_pointer = StrFmt.fmt_branch_remote_pointer(track_branch.name)
-        merge_pointer = StrFmt.fmt_branch_merge_pointer(track_branch.name)
-        rem_name = Git.set_conf_key(self.repo.path, remote_pointer,
-                                    track_branch.remote.name)
-        longname = Git.set_conf_key(self.repo.path, merge_pointer,
-                                    StrFmt.fmt_branch_longname(track_branch.name))
+        self.cmd_set_tracking_all(self.repo, [track_branch])
+
+    @classmethod
+    def cmd_set_tracking_all(cls, repo, track_branches):
+        '''Makes the local branch of the same name track each of
+        track_branches, in a single config write.'''
+        pairs = []
+        for track_branch in track_branches:
+            remote_pointer = StrFmt.fmt_branch_remote_pointer(track_branch.name)
+            merge_pointer = StrFmt.fmt_branch_merge_pointer(track_branch.name)
+            pairs.append((remote_pointer, track_branch.remote.name))
+            pairs.append((merge_pointer, StrFmt.fmt_branch_longname(track_branch.name)))
+        repo.get_config().update(pairs)
+        repo.invalidate_refs()
 
     def cmd_remove(self):
-        if Git.remove_local_branch(self.repo.path, self.name):
+        removed = Git.remove_local_branch(self.repo.location, self.name)
+        self.repo.invalidate_refs()
+        self.repo.invalidate_config()
+        if removed:
             if self.tracking:
                 self.tracking.tracked_by = None
             del(self.repo.branches[self.name])
 
     def cmd_checkout(self):
-        if Git.checkout(self.repo.path, self.name):
+        checked_out = Git.checkout(self.repo.location, self.name)
+        self.repo.invalidate_refs()
+        self.repo.invalidate_worktree()
+        if checked_out:
             return True
 
+    def cmd_fast_forward(self, branch, update_ref=True):
+        '''Moves the branch to the tracked branch by updating the ref, without
+        checking it out, if that is a fast forward. Returns True if the branch
+        does not need to be merged.'''
+        longname = StrFmt.fmt_branch_remote_tracking(branch.remote.name, branch.name)
+        counts = Git.count_ahead_behind(self.repo.location, self.name, longname)
+        if not counts:
+            return False
+
+        ahead, behind = counts
+        if not behind:
+            if ahead:
+                ioutils.suggest('Branch %s is ahead of %s, is pushable' %
+                                (self.name, longname), minor=True)
+            return True
+
+        if ahead or not update_ref:
+            return False
+
+        refs = self.repo.get_refs()
+        old = refs.get_local_tip(self.name)
+        new = refs.get_remote_tracking_tip(longname)
+        if not (old and new):
+            return False
+
+        reason = 're: fast-forward %s to %s' % (self.name, longname)
+        updated = Git.update_ref(self.repo.location, StrFmt.fmt_branch_longname(self.name),
+                                 new, old, reason)
+        self.repo.invalidate_refs()
+        if updated:
+            ioutils.inform('Fast-forwarded %s to %s' % (self.name, longname),
+                           minor=True)
+            ioutils.output('Updating %s..%s' % (old[:7], new[:7]))
+            return True
+        return False
+
     def cmd_merge(self, branch):
         longname = StrFmt.fmt_branch_remote_tracking(branch.remote.name, branch.name)
-        if Git.commit_is_ahead_of(self.repo.path, self.name, longname):
-            ioutils.suggest('Branch %s is ahead of %s, is pushable' %
-                            (self.name, longname), minor=True)
+        counts = Git.count_ahead_behind(self.repo.location, self.name, longname)
+        if counts and not counts[1]:
+            ahead, behind = counts
+            if ahead:
+                ioutils.suggest('Branch %s is ahead of %s, is pushable' %
+                                (self.name, longname), minor=True)
             return True
         else:
             if self.cmd_checkout():
                 remoted = StrFmt.fmt_branch_remote_tracking(branch.remote.name,
                                                             branch.name)
-                merge_ok, output = Git.merge(self.repo.path, remoted)
+                merge_ok, output = Git.merge(self.repo.location, remoted)
+                self.repo.invalidate_refs()
+                self.repo.invalidate_worktree()
                 if merge_ok:
                     if output:
                         ioutils.inform('Merged %s on %s' % (longname, self.name),
@@ -132,7 +216,9 @@ class BranchLocal(Branch):
                         ioutils.output(output)
                     return True
                 else:
-                    Git.reset_hard(self.repo.path, self.name)
+                    Git.reset_hard(self.repo.location, self.name)
+                    self.repo.invalidate_refs()
+                    self.repo.invalidate_worktree()
 
     @classmethod
     def get_branch(cls, repo, name):
@@ -144,14 +230,13 @@ class BranchLocal(Branch):
 
     @classmethod
     def detect_branches(cls, repo):
-        found = []
-        for name in Git.get_branches_local(repo.path):
+        refs = repo.get_refs()
+        for name in refs.local:
             branch = BranchLocal.get_branch(repo, name)
             branch.exists = True
-            found.append(name)
 
         for name in repo.branches:
-            if not name in found:
+            if not refs.has_local(name):
                 repo.branches[name].exists = False
 
 class BranchRemoteTracking(Branch):
@@ -166,11 +251,7 @@ class BranchRemoteTracking(Branch):
         self.tracked_by = None
 
     def check_exists(self):
-        found = False
-        for longname in Git.get_branches_remote_tracking(self.repo.path):
-            if self.longname == longname:
-                found = True
-        self.exists = found
+        self.exists = self.repo.get_refs().has_remote_tracking(self.longname)
 
     @classmethod
     def get_branch(cls, repo, remote, longname, name):
@@ -182,7 +263,7 @@ class BranchRemoteTracking(Branch):
 
     @classmethod
     def detect_branches(cls, repo):
-        for longname in Git.get_branches_remote_tracking(repo.path):
+        for longname in repo.get_refs().remote_tracking:
             if 'HEAD' in longname:  # special case
                 continue
             remote, name = StrFmt.split_branch_longname(longname, parts=2)
@@ -192,17 +273,230 @@ class BranchRemoteTracking(Branch):
 class BranchRemote(Branch):
     pass
 
+class FetchPlan(object):
+    '''How to fetch a remote: the git command to run in the repo, whether it
+    talks to the network, and what to do once it has succeeded. Remote makes
+    the plan, the caller runs the command, blocking or not.'''
+
+    def __init__(self, args, source, network=False):
+        self.args = args
+        self.source = source
+        self.network = network
+        self.register = None
+
+
 class Remote(object):
+    # attributes in the config that say how to fetch the remote, rather than
+    # being urls written to the checkout
+    option_keys = ('depth', 'filter', 'single_branch', 'branches', 'exclude', 'tags')
+
+    filter_aliases = {
+        'blobless': 'blob:none',
+        'treeless': 'tree:0',
+    }
+
     def __init__(self, repo, name=None):
         self.repo = repo
         self.name = name and name or CANONICAL_REMOTE
         self.is_canonical = name == CANONICAL_REMOTE
         self.urls = {}
+        self.options = Settings()
+        self.default_branch = None
         self.branches_tracking = {}
         self.branches_remote = {}
 
-    def cmd_fetch(self):
-        return Git.fetch(self.repo.path, self.name)
+    def get_host(self):
+        '''The host to connect to for fetching, None for local remotes.'''
+        url = self.urls.get('url')
+        if url:
+            scheme, host = StrFmt.split_url(url)
+            if host:
+                return host
+
+    def is_ssh(self):
+        url = self.urls.get('url')
+        return bool(url) and StrFmt.split_url(url)[0] == 'ssh'
+
+    def get_depth(self):
+        '''The depth of the first fetch into a new repo. Later fetches only
+        add the new commits on top of the shallow history. Fetching them at
+        the same depth again would cut the history below the local branches,
+        which then no longer fast forward.'''
+        depth = self.options.get_int('depth')
+        if depth and not self.has_tracking_refs():
+            return depth
+
+    def has_tracking_refs(self):
+        '''Whether anything has been fetched from this remote yet.'''
+        prefix = '%s/' % self.name
+        return any(longname.startswith(prefix)
+                   for longname in self.repo.get_refs().remote_tracking)
+
+    def get_filter(self):
+        spec = self.options.get_str('filter')
+        return self.filter_aliases.get(spec, spec)
+
+    def is_single_branch(self):
+        val = self.options.get_str('single_branch')
+        return bool(val) and val.lower() not in ('0', 'false', 'no', 'off')
+
+    def get_single_branch(self):
+        '''The only branch to fetch, or None to fetch every branch. With
+        single_branch = yes it is the default branch of the remote.'''
+        if not self.is_single_branch():
+            return None
+        if not self.options.get_bool('single_branch'):
+            return self.options.get_str('single_branch')
+
+        # once narrowed, the refspec says which branch is the default
+        if not self.default_branch:
+            for refspec in self.repo.get_config().get_all('remote.%s.fetch' % self.name):
+                m = re.match(r'^[+]?refs/heads/([^*]+):', refspec)
+                if m:
+                    self.default_branch = m.group(1)
+                    break
+            else:
+                self.default_branch = Git.get_remote_head(self.repo.location, self.name)
+        return self.default_branch
+
+    def get_patterns(self, key):
+        '''The branch patterns set for key. A refspec allows a single * and
+        no other wildcards.'''
+        patterns = []
+        for pattern in self.options.get_list(key):
+            pattern = pattern.strip()
+            if pattern.count('*') > 1 or re.search(r'[?\[\]\s]', pattern):
+                logger.warn("Ignoring branch pattern %s of remote %s in '%s'" %
+                            (pattern, self.name, self.repo.location))
+                continue
+            if pattern:
+                patterns.append(pattern)
+        return patterns
+
+    def get_branch_patterns(self):
+        '''Returns the patterns of the branches to fetch, empty to fetch
+        all, and of the branches to leave out.'''
+        branch = self.get_single_branch()
+        includes = branch and [branch] or self.get_patterns('branches')
+        return includes, self.get_patterns('exclude')
+
+    def has_branch_filter(self):
+        return bool(self.is_single_branch() or self.get_patterns('branches') or
+                    self.get_patterns('exclude'))
+
+    def wants_branch(self, name):
+        '''Whether a branch of the remote is tracked and merged locally.'''
+        includes, excludes = self.get_branch_patterns()
+        if includes and not any(fnmatch.fnmatchcase(name, p) for p in includes):
+            return False
+        return not any(fnmatch.fnmatchcase(name, p) for p in excludes)
+
+    def get_refspecs(self, source_prefix='refs/heads'):
+        '''The refspecs that fetch the wanted branches from under
+        source_prefix. Branches are left out with negative refspecs.'''
+        includes, excludes = self.get_branch_patterns()
+        refspecs = ['+%s/%s:refs/remotes/%s/%s' % (source_prefix, p, self.name, p)
+                    for p in includes or ['*']]
+        refspecs += ['^%s/%s' % (source_prefix, p) for p in excludes]
+        return refspecs
+
+    def get_default_refspecs(self):
+        return ['+refs/heads/*:refs/remotes/%s/*' % self.name]
+
+    def is_branch_filter_refspecs(self, refspecs):
+        '''Whether refspecs are ones that get_refspecs writes for a branch
+        filter, rather than the default or refspecs set by the user.'''
+        if not refspecs or refspecs == self.get_default_refspecs():
+            return False
+        for refspec in refspecs:
+            m = re.match(r'^[+]refs/heads/([^:]+):refs/remotes/(.+)$', refspec)
+            if m and m.group(2) == '%s/%s' % (self.name, m.group(1)):
+                continue
+            if re.match(r'^\^refs/heads/[^:]+$', refspec):
+                continue
+            return False
+        return True
+
+    def get_tag_option(self):
+        '''The option of git fetch for the tags policy: all fetches every
+        tag, none no tags and follow (the default) the tags that point into
+        the history that is fetched.'''
+        policy = self.options.get_str('tags', 'follow').lower()
+        return {'all': '--tags', 'none': '--no-tags'}.get(policy)
+
+    def get_source_tag_option(self):
+        '''The tag option when fetching from another repo with the same
+        remote. Its tags are taken as a whole or not at all, never followed:
+        all of them if the remote wants every tag, or if every branch is
+        fetched, when the tags that follow the branches are about all of
+        them. Unlike a refs/tags/* refspec, --tags does not prune the local
+        tags.'''
+        tag_option = self.get_tag_option()
+        if tag_option == '--tags' or (tag_option is None and not self.has_branch_filter()):
+            return '--tags'
+        return '--no-tags'
+
+    def get_fetch_options(self):
+        return {'depth': self.get_depth(), 'filter_spec': self.get_filter()}
+
+    def is_narrowed(self):
+        '''Whether the remote is fetched partially. Such a repo should not
+        serve as the source of a local fetch for a full repo, nor fetch from
+        one, which would bring in everything it leaves out.'''
+        return bool(self.options.get_int('depth') or self.get_filter() or
+                    self.is_single_branch())
+
+    def plan_fetch(self, registry=None, mirrors=None):
+        '''Decides where to fetch the remote from: a mirror, another repo in
+        the workspace with the same url, or the remote itself. Updating the
+        mirror may wait on a lock held by another process.'''
+        url = self.urls.get('url')
+        if self.is_narrowed():
+            registry, mirrors = None, None
+
+        mirror = mirrors and url and mirrors.update(url)
+        if mirror:
+            logger.info('Fetching %s from mirror %s' % (url, mirror))
+            args = Git.fetch_local_args(mirror, self.get_refspecs(),
+                                        tag_option=self.get_tag_option())
+            return FetchPlan(args, mirror)
+
+        source = registry and url and registry.get_source(url)
+        if source:
+            location, remote_name = source
+            logger.info('Fetching %s from %s' % (url, location))
+            refspecs = self.get_refspecs('refs/remotes/%s' % remote_name)
+            args = Git.fetch_local_args(location, refspecs,
+                                        tag_option=self.get_source_tag_option())
+            return FetchPlan(args, location)
+
+        args = Git.fetch_args(self.name, **self.get_fetch_options())
+        plan = FetchPlan(args, self.name, network=True)
+        # a repo that leaves branches out cannot stand in for the remote
+        if registry and url and not self.has_branch_filter():
+            plan.register = lambda: registry.add_source(url, self.repo.location, self.name)
+        return plan
+
+    def complete_fetch(self, plan, ret, err):
+        '''Records the outcome of running the plan, returns whether the
+        fetch succeeded.'''
+        self.repo.invalidate_refs()
+        if ret:
+            logger.error("Fetch error for '%s' from %s: %s" %
+                         (self.repo.location, plan.source, err))
+            return False
+
+        if plan.register:
+            plan.register()
+        return True
+
+    def cmd_fetch(self, registry=None, mirrors=None):
+        plan = self.plan_fetch(registry=registry, mirrors=mirrors)
+        if plan.network:
+            ret, out, err = Git.network.run(self.repo.location, 'fetch', plan.args)
+        else:
+            ret, out, err = ioutils.invoke(self.repo.location, plan.args)
+        return self.complete_fetch(plan, ret, err)
 
     @classmethod
     def get_remote(cls, repo, name):
@@ -234,18 +528,44 @@ class GitRepo(object):
     vcs_tag = 'git'
     vcs_dir = '.git'
 
-    def __init__(self, path):
+    # attributes in the config that apply to the repo rather than a remote
+    option_keys = ('share',)
+
+    # whether the user has been told that git is too old for fsmonitor
+    fsmonitor_warned = False
+
+    def __init__(self, path, root=None):
         self.path = path
+        self.root = root
         self.is_active = False
         self.remotes = {}
         self.branches = {}
+        self.refs = None
+        self.config = None
+        self.worktree = None
+        self.options = Settings()
+        self.shared_store = None
+        self.settings = Settings()
+        self.refs_moved = True
+
+    @property
+    def location(self):
+        '''Where the repo is on disk. path is relative to the workspace root,
+        which need not be the current directory.'''
+        if self.root:
+            return os.path.join(self.root, self.path)
+        return self.path
 
     ### To and from cfg
 
     @classmethod
-    def from_cfg_attributes(cls, path, attributes):
-        repo = GitRepo(path)
+    def from_cfg_attributes(cls, path, attributes, root=None):
+        repo = GitRepo(path, root=root)
         for key, val in attributes.items():
+            if key in cls.option_keys:
+                repo.options[key] = val
+                continue
+
             name, key = StrFmt.split_cfg_key(key)
 
             remote = Remote(repo, name)
@@ -255,7 +575,10 @@ class GitRepo(object):
                 repo.remotes[remote.name] = remote
 
             remote = repo.remotes[remote.name]
-            remote.urls[key] = val
+            if key in Remote.option_keys:
+                remote.options[key] = val
+            else:
+                remote.urls[key] = val
         return repo
 
     def attributes_to_cfg(self):
@@ -279,51 +602,276 @@ class GitRepo(object):
                 att = StrFmt.fmt_cfg_key(remote.name, att)
                 yield att, val
 
+            for att in Remote.option_keys:
+                if att in remote.options:
+                    yield StrFmt.fmt_cfg_key(remote.name, att), remote.options[att]
+
+        for att in self.option_keys:
+            if att in self.options:
+                yield att, self.options[att]
+
+    def copy_options(self, other):
+        '''Takes the repo and remote options from the same repo as read from
+        the config, since they cannot be detected from the checkout.'''
+        self.options.update(other.options)
+        for name, remote in self.remotes.items():
+            if name in other.remotes:
+                remote.options.update(other.remotes[name].options)
+
     ### To and from checkout
 
     @classmethod
-    def from_checkout(cls, path):
-        repo = GitRepo(path)
+    def from_checkout(cls, path, root=None):
+        repo = GitRepo(path, root=root)
+        config = repo.get_config()
 
-        names = Git.get_remotes(path)
+        names = config.get_subsections('remote')
         for name in names:
             remote = Remote(repo, name)
             repo.remotes[name] = remote
 
             for url in ['url', 'pushurl']:
                 key = StrFmt.fmt_remote_key(name, url)
-                val = Git.get_conf_key(path, key)
+                val = config.get(key)
                 if val:
                     remote.urls[url] = val
 
         return repo
 
+    @classmethod
+    def from_remotes(cls, path, remotes, root=None):
+        '''Constructs a repo from a list of (name, urls) as returned by
+        remotes_to_list, eg. for a repo read from the scan cache.'''
+        repo = GitRepo(path, root=root)
+        for name, urls in remotes:
+            remote = Remote(repo, name)
+            remote.urls.update(urls)
+            repo.remotes[name] = remote
+        return repo
+
+    def remotes_to_list(self):
+        return [(remote.name, dict(remote.urls))
+                for remote in self.remotes.values()]
+
+    @classmethod
+    def get_checkout_stamp(cls, path):
+        '''The mtime of the repo config, which changes when remotes do.'''
+        try:
+            return os.stat(os.path.join(path, cls.vcs_dir, 'config')).st_mtime
+        except OSError:
+            return None
+
+    def set_worktree_options(self):
+        '''Turns on the caches that make git status faster on big working
+        trees, if the settings ask for them.'''
+        pairs = []
+        if self.settings.get_bool('worktree.untracked_cache', False):
+            pairs.append(('core.untrackedCache', 'true'))
+        if self.settings.get_bool('worktree.fsmonitor', False):
+            # before 2.36 git runs the value as a hook command
+            if Git.get_version() >= (2, 36):
+                pairs.append(('core.fsmonitor', 'true'))
+            elif not GitRepo.fsmonitor_warned:
+                GitRepo.fsmonitor_warned = True
+                ioutils.complain('Not setting core.fsmonitor, it needs git 2.36 or later')
+        if pairs:
+            self.get_config().update(pairs)
+
     def set_remotes_in_checkout(self):
         logger.info('Setting remotes in checkout')
 
         # remove remotes not in model
-        remotes_names = Git.get_remotes(self.path)
-        names = filter(lambda n: n not in self.remotes, remotes_names)
-        for name in names:
-            Git.remove_remote(self.path, name)
+        remotes_names = self.get_config().get_subsections('remote')
+        removed = list(filter(lambda n: n not in self.remotes, remotes_names))
+        for name in removed:
+            Git.remove_remote(self.location, name)
+            self.invalidate_refs()
 
         # add remotes not in checkout
-        names = filter(lambda n: n not in remotes_names, self.remotes.keys())
-        for name in names:
-            Git.add_remote(self.path, name, self.remotes[name].urls['url'])
+        added = list(filter(lambda n: n not in remotes_names, self.remotes.keys()))
+        for name in added:
+            Git.add_remote(self.location, name, self.remotes[name].urls['url'])
 
-        # overwrite urls in checkout
+        if removed or added:
+            self.invalidate_config()
+
+        # overwrite urls in checkout that differ from the model
+        pairs = []
         for remote in self.remotes.values():
             for key, val in remote.urls.items():
                 key = StrFmt.fmt_remote_key(remote.name, key)
-                Git.set_conf_key(self.path, key, val)
+                pairs.append((key, val))
+
+        self.get_config().update(pairs)
+
+        # fetch only the wanted branches, eg. a single one like clone
+        # --single-branch. Once the filter is removed the remote fetches
+        # every branch again. Refspecs set by the user are left alone.
+        for remote in self.remotes.values():
+            fetch_key = StrFmt.fmt_remote_key(remote.name, 'fetch')
+            if remote.has_branch_filter():
+                if remote.is_single_branch() and not remote.get_single_branch():
+                    continue
+                self.get_config().update_all(fetch_key, remote.get_refspecs())
+            elif remote.is_branch_filter_refspecs(self.get_config().get_all(fetch_key)):
+                self.get_config().update_all(fetch_key, remote.get_default_refspecs())
+
+            tag_key = StrFmt.fmt_remote_key(remote.name, 'tagOpt')
+            if 'tags' in remote.options:
+                tag_option = remote.get_tag_option()
+                self.get_config().update_all(tag_key, tag_option and [tag_option] or [])
+            elif self.get_config().get(tag_key) in ('--tags', '--no-tags'):
+                self.get_config().update_all(tag_key, [])
 
     ### Queries
 
+    def get_refs(self):
+        if self.refs is None:
+            self.refs = RefSnapshot.from_checkout(self.location)
+        return self.refs
+
+    def invalidate_refs(self):
+        self.refs = None
+
+    def get_config(self):
+        if self.config is None:
+            self.config = ConfigCache(self.location)
+        return self.config
+
+    def invalidate_config(self):
+        if self.config is not None:
+            self.config.invalidate()
+        self.config = None
+
+    def get_worktree(self):
+        '''The state of HEAD, the tracked files and the stash. Probed once and
+        reused until an operation that changes it invalidates it.'''
+        if self.worktree is None:
+            self.worktree = RepoStatus.probe(self.location)
+        return self.worktree
+
+    def invalidate_worktree(self):
+        self.worktree = None
+
+    def get_checked_out(self):
+        worktree = self.get_worktree()
+        return worktree and worktree.get_checked_out()
+
+    def is_clean(self):
+        '''Whether tracked files are unchanged, untracked files do not count.'''
+        worktree = self.get_worktree()
+        return not (worktree and worktree.is_dirty())
+
+    def get_hosts(self):
+        hosts = set()
+        for remote in self.remotes.values():
+            host = remote.get_host()
+            if host:
+                hosts.add(host)
+        return sorted(hosts)
+
+    def get_urls(self):
+        urls = set()
+        for remote in self.remotes.values():
+            url = remote.urls.get('url')
+            if url:
+                urls.add(url)
+        return sorted(urls)
+
     def is_checked_out(self):
-        if os.path.exists(os.path.join(self.path, '.git')):
+        if os.path.exists(os.path.join(self.location, '.git')):
             return True
 
+    def get_share_group(self):
+        '''The group of repos to share objects with as declared in the
+        config, None to share with the repos that have a url in common, or
+        False not to share.'''
+        val = self.options.get_str('share')
+        if val and val.lower() in ('0', 'false', 'no', 'off'):
+            return False
+        # a shallow or partial repo is missing objects the store would
+        # expect it to have
+        if any(remote.is_narrowed() for remote in self.remotes.values()):
+            return False
+        if val and val.lower() in ('1', 'true', 'yes', 'on'):
+            return None
+        return val
+
+    def get_status(self):
+        '''Returns the RepoStatus of the checkout, or None if the repo is not
+        checked out.'''
+        if not self.is_checked_out():
+            return None
+        return RepoStatus.from_checkout(self.location)
+
+    def needs_merge(self):
+        '''Whether there is anything for cmd_merge to do: remote tracking
+        branches moved during the fetch, tracking branches need to be set up
+        or removed, or a local branch is not at its upstream.'''
+        if self.refs_moved:
+            return True
+
+        refs = self.get_refs()
+        for branch in self.branches.values():
+            if branch.follows_upstream():
+                tracking = branch.tracking
+                if not refs.has_remote_tracking(tracking.longname):
+                    return True
+                if (refs.get_local_tip(branch.name) !=
+                    refs.get_remote_tracking_tip(tracking.longname)):
+                    return True
+
+        remote = Remote.get_canonical_remote(self)
+        for branch in remote.branches_tracking.values():
+            if not branch.tracked_by and remote.wants_branch(branch.name):
+                return True
+
+        return False
+
+    def has_linked_worktrees(self):
+        gitdir = os.path.join(self.location, '.git')
+        if not os.path.isdir(gitdir):
+            return True
+        return os.path.isdir(os.path.join(gitdir, 'worktrees'))
+
+    def is_checkout_free(self):
+        '''Branches that are not checked out are fast forwarded by moving the
+        ref, only the current branch and real merges touch the workdir. Not
+        done with linked worktrees, where a branch may be checked out
+        elsewhere.'''
+        return (self.settings.get_bool('merge.checkout_free', True) and
+                not self.has_linked_worktrees())
+
+    def needs_interaction(self):
+        '''Returns why merging may need the user, eg. to answer a prompt or
+        to deal with a conflict, or None if it can run unattended.'''
+        Branch.check_heartbeats(self)
+
+        current = self.get_checked_out()
+        checkout_free = self.is_checkout_free()
+        needs_workdir = False
+
+        for branch in self.branches.values():
+            if not branch.follows_upstream():
+                continue
+            if not branch.tracking.exists:
+                return 'stale local tracking branch %s' % branch.name
+
+            longname = StrFmt.fmt_branch_remote_tracking(branch.tracking.remote.name,
+                                                         branch.tracking.name)
+            counts = Git.count_ahead_behind(self.location, branch.name, longname)
+            if not counts:
+                return 'cannot compare %s to its upstream' % branch.name
+            ahead, behind = counts
+            if ahead and behind:
+                return 'branch %s has diverged from its upstream' % branch.name
+            if behind and (branch.name == current or not checkout_free):
+                needs_workdir = True
+
+        # a stash that is reapplied after merging can conflict
+        if needs_workdir and not self.is_clean():
+            return 'working tree has changes'
+
     def get_branch_to_checkout_after_deletion(self, branch):
         # Try to select either 'master' or 'main' if they exist in the repo
         defaults = ['master', 'main']
@@ -341,8 +889,11 @@ class GitRepo(object):
     def do_init_repo(self):
         logger.info('Initializing repo')
 
-        os.makedirs(self.path)
-        Git.repo_init(self.path)
+        os.makedirs(self.location)
+        Git.repo_init(self.location)
+        self.invalidate_refs()
+        self.invalidate_config()
+        self.invalidate_worktree()
         self.set_remotes_in_checkout()
 
     def detect_branches(self, only_remote=False, update_tracking=False):
@@ -361,7 +912,7 @@ class GitRepo(object):
         logger.info('Checking for stale local tracking branches')
 
         for branch in list(self.branches.values()):
-            if getattr(branch, 'tracking', None) and not branch.tracking.exists:
+            if branch.follows_upstream() and not branch.tracking.exists:
                 if ioutils.prompt('Stale local tracking branch %s, remove?' %
                                   branch.name, minor=True):
                     # check out another branch
@@ -375,94 +926,182 @@ class GitRepo(object):
     def setup_local_tracking_branches(self):
         logger.info('Setting up local tracking branches')
 
+        # the branches are set up together, in one ref transaction and one
+        # config write
+        to_set, to_add = [], []
         remote = Remote.get_canonical_remote(self)
         for branch in remote.branches_tracking.values():
-            if not branch.tracked_by:
+            if not branch.tracked_by and remote.wants_branch(branch.name):
                 local_branch = self.branches.get(branch.name, None)
                 if local_branch:
                     ioutils.inform('Setting local branch %s to track %s/%s' %
                                    (branch.name, branch.remote.name,
                                     branch.name), minor=True)
-                    local_branch.cmd_set_tracking(branch)
+                    to_set.append(branch)
                 else:
                     ioutils.inform('Setting up local tracking branch %s' %
                                    branch.name, minor=True)
-                    BranchLocal.cmd_add_tracking(self, branch)
+                    to_add.append(branch)
+
+        if to_set:
+            BranchLocal.cmd_set_tracking_all(self, to_set)
+        BranchLocal.cmd_add_tracking_all(self, to_add)
 
     def merge_local_tracking_branches(self):
         logger.info('Merging local tracking branches')
 
-        save_commit = Git.get_checked_out_commit(self.path)
+        save_commit = self.get_checked_out()
         if save_commit is None:
-            ioutils.complain('Failed to get last commit for %s' % self.path)
+            ioutils.complain('Failed to get last commit for %s' % self.location)
             return
 
         # checkout current branch in case repo has just been cloned and workdir
         # is empty
-        if not Git.repo_is_clean(self.path):
+        if not self.is_clean():
             if save_commit in self.branches:
                 self.branches[save_commit].cmd_checkout()
 
+        checkout_free = self.is_checkout_free()
+
+        to_merge = []
+        for branch in self.branches.values():
+            if branch.follows_upstream():
+                if checkout_free:
+                    is_current = branch.name == save_commit
+                    if branch.cmd_fast_forward(branch.tracking,
+                                               update_ref=not is_current):
+                        continue
+                to_merge.append(branch)
+
+        if not to_merge:
+            return
+
         # if the workdir is not clean we will stash it first
         stashed = False
-        if not Git.repo_is_clean(self.path):
-            if Git.stash(self.path):
+        if not self.is_clean():
+            stashes = self.get_worktree().stashes
+            Git.stash(self.location)
+            self.invalidate_worktree()
+            if Git.get_stash_count(self.location) > stashes:
                 ioutils.inform('Repo is dirty, stashed at %s' % save_commit, minor=True)
                 stashed = True
 
         # merge all tracking branches
-        for branch in self.branches.values():
-            if branch.tracking:
-                if not branch.cmd_merge(branch.tracking):
-                    ioutils.complain('Merge failed at %s of %s/%s' %
-                                     (branch.name, branch.tracking.remote.name,
-                                      branch.tracking.name), minor=True)
+        for branch in to_merge:
+            if not branch.cmd_merge(branch.tracking):
+                ioutils.complain('Merge failed at %s of %s/%s' %
+                                 (branch.name, branch.tracking.remote.name,
+                                  branch.tracking.name), minor=True)
 
         # check out the "current branch" again - so we end on the same branch
         # checked out as we had in the beginning
         if save_commit in self.branches:
-            if Git.checkout(self.path, save_commit):
+            checked_out = Git.checkout(self.location, save_commit)
+            self.invalidate_refs()
+            self.invalidate_worktree()
+            if checked_out:
 
                 # apply the stash back onto the workdir (could create a conflict)
-                if stashed and Git.stash(self.path, apply=True):
+                if stashed and Git.stash(self.location, apply=True):
                     ioutils.inform('Restored stash at %s' % save_commit, minor=True)
+                self.invalidate_worktree()
 
     ### Commands
 
-    def cmd_compact(self, check=True):
-        ioutils.inform('Checking for compactness: %s' % self.path)
+    def get_size(self):
+        '''The size of the object store in KiB.'''
+        stats = Git.count_objects(self.location) or {}
+        return CompactPolicy.get_size(stats)
+
+    def cmd_compact(self, check=True, threads=None):
+        ioutils.inform('Checking for compactness: %s' % self.location)
+
+        stats = Git.count_objects(self.location)
+        if stats is None:
+            return
 
-        def do_check(output_always=False):
-            is_compact, output = Git.check_compactness_local(self.path)
-            if not is_compact or output_always:
-                ioutils.output(output)
-            return is_compact
+        policy = CompactPolicy.from_settings(self.settings)
+        action = policy.choose(stats)
+        if not action:
+            return
 
-        is_compact = do_check()
-        if not check and not is_compact:
-            ioutils.inform('Trying to compact', minor=True)
-            Git.compact_local(self.path)
-            do_check(output_always=True)
+        ioutils.output(CompactPolicy.format_stats(stats))
+        if check:
+            ioutils.suggest('%s would compact it' %
+                            CompactAction.descriptions[action], minor=True)
+            return
 
-    def cmd_fetch(self):
-        ioutils.inform('Fetching %s' % self.path)
+        ioutils.inform(CompactAction.descriptions[action], minor=True)
+        prune_expire = self.get_config().get('gc.pruneExpire')
+        if action == CompactAction.PRUNE_PACKED:
+            ok = Git.prune_packed(self.location)
+        elif action == CompactAction.PRUNE:
+            ok = Git.prune(self.location, expire=prune_expire)
+        elif action == CompactAction.REPACK:
+            ok = Git.repack(self.location, threads=threads)
+            # what is still loose after the repack is unreachable
+            if ok and policy.choose_next(Git.count_objects(self.location) or {}):
+                ioutils.inform(CompactAction.descriptions[CompactAction.PRUNE], minor=True)
+                ok = Git.prune(self.location, expire=prune_expire)
+        elif action == CompactAction.GEOMETRIC:
+            ok = Git.repack(self.location, geometric=True, threads=threads)
+            # fall back to a full gc if git does not know --geometric (before
+            # 2.32), or if the progression still has too many packs
+            if not ok or policy.is_over_packs(Git.count_objects(self.location) or {}):
+                ioutils.inform(CompactAction.descriptions[CompactAction.GC], minor=True)
+                ok = Git.compact_local(self.location, threads=threads)
+        else:
+            ok = Git.compact_local(self.location, threads=threads)
+
+        after = Git.count_objects(self.location)
+        if after is not None:
+            ioutils.output(CompactPolicy.format_stats(after))
+            reclaimed = CompactPolicy.get_size(stats) - CompactPolicy.get_size(after)
+            ioutils.inform('Reclaimed %s' % CompactPolicy.format_size(max(reclaimed, 0)),
+                           minor=True)
+            # recent unreachable objects and garbage are kept until they
+            # are older than gc.pruneExpire
+            if policy.choose_next(after):
+                ioutils.complain('Objects too recent to prune are left, see git count-objects -vH',
+                                 minor=True)
+        if not ok:
+            ioutils.complain('Failed compacting %s' % self.location)
+
+    def cmd_fetch(self, registry=None, mirrors=None):
+        ioutils.inform('Fetching %s' % self.location)
+
+        tips_before = self.prepare_fetch()
+        success = True
+        for remote in self.remotes.values():
+            success = success and remote.cmd_fetch(registry=registry, mirrors=mirrors)
+        return self.finish_fetch(tips_before, success)
 
-        if not os.path.exists(self.path):
+    def prepare_fetch(self):
+        '''Gets the checkout ready to be fetched into, returns the remote
+        tracking branches before the fetch.'''
+        if not os.path.exists(self.location):
             self.do_init_repo()
+        if self.shared_store:
+            self.shared_store.attach(self)
 
-        success = True
         self.set_remotes_in_checkout()
+        self.set_worktree_options()
         self.detect_branches(update_tracking=True)
-        for remote in self.remotes.values():
-            success = success and remote.cmd_fetch()
+        return dict(self.get_refs().remote_tracking)
+
+    def finish_fetch(self, tips_before, success):
         self.detect_branches(only_remote=True)
+        self.refs_moved = tips_before != self.get_refs().remote_tracking
 
         if not success:
-            ioutils.complain('Failed fetching %s' % self.path)
+            ioutils.complain('Failed fetching %s' % self.location)
         return success
 
     def cmd_merge(self):
-        ioutils.inform('Merging %s' % self.path)
+        ioutils.inform('Merging %s' % self.location)
+
+        # the user may have worked in the checkout since it was last probed
+        self.invalidate_worktree()
 
         # Check branch heartbeats after fetch
         Branch.check_heartbeats(self)
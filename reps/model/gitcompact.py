@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+
+
+class CompactAction(object):
+    PRUNE_PACKED = 'prune-packed'
+    REPACK = 'repack'
+    GEOMETRIC = 'geometric'
+    PRUNE = 'prune'
+    GC = 'gc'
+
+    descriptions = {
+        PRUNE_PACKED: 'Removing loose objects that are already packed',
+        REPACK: 'Packing loose objects',
+        GEOMETRIC: 'Repacking small packs',
+        PRUNE: 'Pruning unreachable objects',
+        GC: 'Running full gc',
+    }
+
+
+class CompactPolicy(object):
+    '''Decides how to compact a repo from the stats of git count-objects -v,
+    picking the cheapest action that brings the repo under the thresholds.'''
+
+    def __init__(self, max_loose=100, max_packs=50, max_garbage=0):
+        self.max_loose = max_loose
+        self.max_packs = max_packs
+        self.max_garbage = max_garbage
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            max_loose=settings.get_int('compact.max_loose', 100),
+            max_packs=settings.get_int('compact.max_packs', 50),
+            max_garbage=settings.get_int('compact.max_garbage', 0),
+        )
+
+    def choose(self, stats):
+        '''Returns the action to take, or None if the repo is compact.'''
+        if self.is_over_packs(stats):
+            return CompactAction.GEOMETRIC
+        if self.is_over_loose(stats):
+            return CompactAction.REPACK
+        if self.is_over_garbage(stats):
+            return CompactAction.PRUNE
+        if stats.get('prune-packable', 0):
+            return CompactAction.PRUNE_PACKED
+        return None
+
+    def choose_next(self, stats):
+        '''Returns the action to escalate to after a repack, or None. Loose
+        objects that a repack leaves behind are unreachable, only pruning
+        removes them.'''
+        if self.is_over_loose(stats) or self.is_over_garbage(stats):
+            return CompactAction.PRUNE
+        return None
+
+    def is_over_packs(self, stats):
+        return stats.get('packs', 0) > self.max_packs
+
+    def is_over_loose(self, stats):
+        return stats.get('count', 0) > self.max_loose
+
+    def is_over_garbage(self, stats):
+        return stats.get('garbage', 0) > self.max_garbage
+
+    @classmethod
+    def get_size(cls, stats):
+        '''The disk space taken by the object store, in KiB.'''
+        return (stats.get('size', 0) + stats.get('size-pack', 0) +
+                stats.get('size-garbage', 0))
+
+    @classmethod
+    def format_size(cls, kib):
+        if kib >= 1024 * 1024:
+            return '%.1f GiB' % (kib / (1024.0 * 1024))
+        if kib >= 1024:
+            return '%.1f MiB' % (kib / 1024.0)
+        return '%d KiB' % kib
+
+    @classmethod
+    def format_stats(cls, stats):
+        return 'loose objects: %d (%s), packs: %d (%s), garbage: %d (%s)' % (
+            stats.get('count', 0), cls.format_size(stats.get('size', 0)),
+            stats.get('packs', 0), cls.format_size(stats.get('size-pack', 0)),
+            stats.get('garbage', 0), cls.format_size(stats.get('size-garbage', 0)),
+        )
@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+
+from reps.backends import Git
+from reps.compat import OrderedDict
+
+
+class ConfigCache(object):
+    '''The config of a repo, as read from the config files under .git, or by
+    a single call to git if the files cannot be parsed. Writes are
+    compared against the cached values and only keys that differ are
+    written to the checkout.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.values = None
+
+    def load(self):
+        if self.values is None:
+            pairs = Git.get_conf_list(self.path)
+
+            self.values = OrderedDict()
+            for key, value in pairs:
+                self.values.setdefault(self.normalize_key(key), []).append(value)
+        return self.values
+
+    def invalidate(self):
+        self.values = None
+
+    @classmethod
+    def normalize_key(cls, key):
+        '''Section and variable names are case insensitive, the subsection
+        (eg. the remote name) is not.'''
+        section, _, rest = key.partition('.')
+        if '.' in rest:
+            subsection, _, var = rest.rpartition('.')
+            return '%s.%s.%s' % (section.lower(), subsection, var.lower())
+        return '%s.%s' % (section.lower(), rest.lower())
+
+    def get(self, key):
+        vals = self.load().get(self.normalize_key(key))
+        if vals:
+            return vals[-1]
+
+    def get_all(self, key):
+        return list(self.load().get(self.normalize_key(key), []))
+
+    def get_subsections(self, section):
+        '''Returns eg. the names of all remotes for section=remote, in the
+        order they appear in the config.'''
+        prefix = '%s.' % section
+        names = []
+        for key in self.load():
+            if key.startswith(prefix) and key.count('.') >= 2:
+                name = key[len(prefix):].rpartition('.')[0]
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def update(self, pairs):
+        '''Sets the given keys, writing only those whose value differs from
+        the cached value, in a single write. Returns the number of keys
+        written.'''
+        changed = OrderedDict()
+        for key, value in pairs:
+            if self.get_all(key) != [value]:
+                changed[self.normalize_key(key)] = (key, value)
+        changed = list(changed.values())
+
+        if changed:
+            Git.set_conf_keys(self.path, changed)
+            values = self.load()
+            for key, value in changed:
+                values[self.normalize_key(key)] = [value]
+
+        return len(changed)
+
+    def update_all(self, key, values):
+        '''Sets all the values of a multi-valued key, if they differ from the
+        cached values.'''
+        if self.get_all(key) == list(values):
+            return False
+
+        Git.set_conf_key_all(self.path, key, values)
+        vals = self.load()
+        if values:
+            vals[self.normalize_key(key)] = list(values)
+        else:
+            vals.pop(self.normalize_key(key), None)
+        return True
@@ -0,0 +1,51 @@
+from __future__ import absolute_import
+
+from reps.backends import Git
+
+
+class RefSnapshot(object):
+    '''The local and remote tracking branches of a repo, as read by a single
+    call to git. The snapshot is reused until an operation that changes
+    refs invalidates it.'''
+
+    local_prefix = 'refs/heads/'
+    remote_prefix = 'refs/remotes/'
+
+    def __init__(self):
+        self.local = {}            # name -> sha
+        self.remote_tracking = {}  # remote/name -> sha
+        self.upstreams = {}        # name -> (remote, refs/heads/name)
+        self.current = None
+
+    @classmethod
+    def from_checkout(cls, path):
+        snapshot = cls()
+        for refname, sha, remote, remoteref, is_head in Git.get_refs(path):
+            if refname.startswith(cls.local_prefix):
+                name = refname[len(cls.local_prefix):]
+                snapshot.local[name] = sha
+                if remote and remoteref:
+                    snapshot.upstreams[name] = (remote, remoteref)
+                if is_head:
+                    snapshot.current = name
+
+            elif refname.startswith(cls.remote_prefix):
+                longname = refname[len(cls.remote_prefix):]
+                snapshot.remote_tracking[longname] = sha
+
+        return snapshot
+
+    def has_local(self, name):
+        return name in self.local
+
+    def has_remote_tracking(self, longname):
+        return longname in self.remote_tracking
+
+    def get_upstream(self, name):
+        return self.upstreams.get(name)
+
+    def get_local_tip(self, name):
+        return self.local.get(name)
+
+    def get_remote_tracking_tip(self, longname):
+        return self.remote_tracking.get(longname)
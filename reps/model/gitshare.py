@@ -0,0 +1,172 @@
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import os
+import re
+
+from reps import consts
+from reps import ioutils
+from reps.backends import Git
+from reps.compat import OrderedDict
+from reps.model.gitconfig import ConfigCache
+from reps.model.gitstrings import StrFmt
+
+logger = logging
+
+
+class SharedStore(object):
+    '''A bare repo holding the objects of a group of repos that share
+    history, eg. forks of the same project. The repos borrow its objects
+    through git alternates, so that a fetch only downloads what the store
+    does not have yet.
+
+    The store fetches the urls of every repo in the group, and is never
+    pruned or gc'd: a repo may depend on any object in it.'''
+
+    def __init__(self, path, name, repos):
+        self.path = path
+        self.name = name
+        self.repos = repos
+
+    @classmethod
+    def find_groups(cls, repos):
+        '''Groups repos declared to be in the same group (share = <name>),
+        or with a remote url in common. Returns a dict of group name to
+        repos, only for groups with more than one repo.'''
+        parent = {}
+
+        def find(key):
+            while parent.setdefault(key, key) != key:
+                key = parent[key]
+            return key
+
+        def union(a, b):
+            parent[find(a)] = find(b)
+
+        candidates = []
+        for repo in repos:
+            group = repo.get_share_group()
+            if group is False:
+                continue
+            candidates.append(repo)
+            keys = ['url:%s' % url for url in repo.get_urls()]
+            if group:
+                keys.append('group:%s' % group)
+            for key in keys:
+                union(('repo', repo.path, repo.root), key)
+
+        groups = OrderedDict()
+        for repo in candidates:
+            groups.setdefault(find(('repo', repo.path, repo.root)), []).append(repo)
+
+        val = OrderedDict()
+        for members in groups.values():
+            if len(members) > 1:
+                val[cls.get_group_name(members)] = members
+        return val
+
+    @classmethod
+    def get_group_name(cls, repos):
+        for repo in repos:
+            group = repo.get_share_group()
+            if group:
+                return group
+
+        # eg. linux-1b2c3d4e for https://github.com/torvalds/linux.git
+        url = sorted(url for repo in repos for url in repo.get_urls())[0]
+        basename = re.sub(r'\.git$', '', url.rstrip('/').rsplit('/', 1)[-1])
+        basename = re.sub(r'[^A-Za-z0-9._-]', '_', basename.rsplit(':', 1)[-1])
+        return '%s-%s' % (basename, cls.hash_url(url)[:8])
+
+    @classmethod
+    def hash_url(cls, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def assign(cls, repos, share_dir=None):
+        '''Sets up a store for every group among repos, and makes each repo
+        use the store of its group. Returns the stores.'''
+        stores = []
+        for name, members in cls.find_groups(repos).items():
+            store_dir = share_dir or os.path.join(members[0].root or '.',
+                                                  consts.SHARED_OBJECTS_DIR)
+            path = os.path.join(os.path.abspath(os.path.expanduser(store_dir)),
+                                '%s.git' % name)
+            store = cls(path, name, members)
+            for repo in members:
+                repo.shared_store = store
+            stores.append(store)
+        return stores
+
+    def get_urls(self):
+        return sorted(set(url for repo in self.repos for url in repo.get_urls()))
+
+    def get_hosts(self):
+        return sorted(set(host for repo in self.repos for host in repo.get_hosts()))
+
+    def get_objects_dir(self):
+        return os.path.join(self.path, 'objects')
+
+    def get_remote_name(self, url):
+        return 'u%s' % self.hash_url(url)[:12]
+
+    def init(self):
+        if not os.path.exists(self.path):
+            logger.info('Creating shared object store %s' % self.path)
+            os.makedirs(self.path)
+            Git.repo_init_bare(self.path)
+
+        # objects only referenced by the repos that borrow them must not be
+        # thrown away
+        pairs = [
+            ('gc.auto', '0'),
+            ('gc.pruneExpire', 'never'),
+            ('maintenance.auto', 'false'),
+        ]
+        for url in self.get_urls():
+            name = self.get_remote_name(url)
+            pairs.append((StrFmt.fmt_remote_key(name, 'url'), url))
+            pairs.append((StrFmt.fmt_remote_key(name, 'fetch'),
+                          '+refs/heads/*:refs/remotes/%s/*' % name))
+        ConfigCache(self.path).update(pairs)
+
+    def cmd_fetch(self):
+        ioutils.inform('Fetching shared objects %s' % self.name)
+        self.init()
+
+        success = True
+        for url in self.get_urls():
+            if not Git.fetch(self.path, self.get_remote_name(url)):
+                success = False
+        if not success:
+            ioutils.complain('Failed fetching shared objects %s' % self.name)
+        return success
+
+    def attach(self, repo):
+        '''Makes the repo borrow objects from the store, if it does not yet.'''
+        if not (os.path.isdir(self.get_objects_dir()) and
+                os.path.isdir(os.path.join(repo.location, repo.vcs_dir))):
+            return
+        alternates = Git.get_alternates(repo.location)
+        if self.get_objects_dir() not in alternates:
+            logger.info('Using shared objects %s in %s' % (self.name, repo.location))
+            Git.set_alternates(repo.location, alternates + [self.get_objects_dir()])
+
+    @classmethod
+    def detach(cls, repo):
+        '''Copies every object the repo borrows into the repo itself, then
+        stops borrowing. The repo no longer depends on any store.'''
+        alternates = Git.get_alternates(repo.location)
+        if not alternates:
+            return True
+
+        ioutils.inform('Copying shared objects into %s' % repo.location)
+        if not Git.repack_all(repo.location):
+            ioutils.complain('Failed copying shared objects into %s' % repo.location)
+            return False
+
+        Git.set_alternates(repo.location, [])
+        for path in alternates:
+            ioutils.inform('Detached from %s' % path, minor=True)
+        return True
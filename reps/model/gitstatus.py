@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+
+import re
+
+from reps.backends import Git
+
+
+class TrackingStatus(object):
+    def __init__(self, branch, upstream, ahead=0, behind=0, gone=False):
+        self.branch = branch
+        self.upstream = upstream
+        self.ahead = ahead
+        self.behind = behind
+        self.gone = gone
+
+    @classmethod
+    def from_track(cls, branch, upstream, track):
+        '''Parses the %(upstream:track,nobracket) of for-each-ref.'''
+        status = cls(branch, upstream, gone=track == 'gone')
+        for word, count in re.findall(r'(ahead|behind) (\d+)', track):
+            setattr(status, word, int(count))
+        return status
+
+    def is_in_sync(self):
+        return not (self.ahead or self.behind or self.gone)
+
+    def format(self):
+        if self.gone:
+            return 'upstream gone'
+        counts = []
+        if self.ahead:
+            counts.append('ahead %s' % self.ahead)
+        if self.behind:
+            counts.append('behind %s' % self.behind)
+        return ', '.join(counts) or 'up to date'
+
+    def to_dict(self):
+        return {
+            'branch': self.branch,
+            'upstream': self.upstream,
+            'ahead': self.ahead,
+            'behind': self.behind,
+            'gone': self.gone,
+        }
+
+
+class RepoStatus(object):
+    '''The state of a checkout: the checked out branch, changes in the
+    working tree, stashes and how each local branch compares to its
+    upstream. Collected without talking to any remote.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.branch = None   # None if detached
+        self.commit = None   # None in a repo without commits
+        self.staged = 0
+        self.unstaged = 0
+        self.untracked = 0
+        self.conflicts = 0
+        self.stashes = 0
+        self.tracking = []
+
+    @classmethod
+    def from_checkout(cls, path, untracked=True, tracking=True):
+        lines = Git.get_status(path, untracked=untracked)
+        if lines is None:
+            return None
+
+        status = cls(path)
+        status.parse_porcelain(lines)
+        status.stashes = Git.get_stash_count(path)
+        if tracking:
+            for branch, upstream, track in Git.get_tracking(path):
+                if upstream:
+                    status.tracking.append(TrackingStatus.from_track(branch, upstream, track))
+        return status
+
+    @classmethod
+    def probe(cls, path):
+        '''The state of HEAD, the tracked files and the stash only, which is
+        all merging needs to know and much cheaper on a big working tree.'''
+        return cls.from_checkout(path, untracked=False, tracking=False)
+
+    def parse_porcelain(self, lines):
+        '''Parses the output of git status --porcelain=v2 --branch.'''
+        for line in lines:
+            if line.startswith('# branch.oid '):
+                oid = line[len('# branch.oid '):]
+                self.commit = oid != '(initial)' and oid or None
+            elif line.startswith('# branch.head '):
+                head = line[len('# branch.head '):]
+                self.branch = head != '(detached)' and head or None
+            elif line.startswith('1 ') or line.startswith('2 '):
+                xy = line[2:4]
+                if xy[0] != '.':
+                    self.staged += 1
+                if xy[1] != '.':
+                    self.unstaged += 1
+            elif line.startswith('u '):
+                self.conflicts += 1
+            elif line.startswith('? '):
+                self.untracked += 1
+
+    def get_checked_out(self):
+        '''The checked out branch, or the commit if detached, like
+        Git.get_checked_out_commit. None on a branch without commits.'''
+        if not self.commit:
+            return None
+        return self.branch or self.commit
+
+    def is_dirty(self):
+        return bool(self.staged or self.unstaged or self.conflicts)
+
+    def is_in_sync(self):
+        return all(tracking.is_in_sync() for tracking in self.tracking)
+
+    def format_head(self):
+        if self.branch:
+            return self.branch
+        if self.commit:
+            return '(detached at %s)' % self.commit[:7]
+        return '(no commits)'
+
+    def format_changes(self):
+        changes = []
+        for count, label in [(self.conflicts, 'conflicts'),
+                             (self.staged, 'staged'),
+                             (self.unstaged, 'modified'),
+                             (self.untracked, 'untracked'),
+                             (self.stashes, 'stashed')]:
+            if count:
+                changes.append('%s %s' % (count, label))
+        return ', '.join(changes) or 'clean'
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'branch': self.branch,
+            'commit': self.commit,
+            'dirty': self.is_dirty(),
+            'staged': self.staged,
+            'unstaged': self.unstaged,
+            'untracked': self.untracked,
+            'conflicts': self.conflicts,
+            'stashes': self.stashes,
+            'tracking': [tracking.to_dict() for tracking in self.tracking],
+        }
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import re
+
 
 class StrFmt(object):
     @classmethod
@@ -44,3 +46,22 @@ class StrFmt(object):
     @classmethod
     def fmt_branch_merge_pointer(cls, branch):
         return 'branch.%s.merge' % branch
+
+    @classmethod
+    def split_url(cls, url):
+        '''Returns the scheme and host of a remote url. scp-style urls like
+        git@github.com:foo/bar.git have the scheme ssh, local paths have the
+        scheme file and no host.'''
+        m = re.match(r'^([a-z][a-z0-9+.-]*)://(?:[^@/]*@)?(\[[^\]]*\]|[^:/]*)',
+                     url, re.I)
+        if m:
+            scheme = m.group(1).lower()
+            if 'ssh' in scheme.split('+'):
+                scheme = 'ssh'
+            return scheme, m.group(2).lower()
+
+        m = re.match(r'^(?:[^@/]*@)?([^:/]+):', url)
+        if m:
+            return 'ssh', m.group(1).lower()
+
+        return 'file', ''
@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+
+import logging
+import random
+import threading
+import time
+
+from reps import consts
+from reps import ioutils
+
+logger = logging
+
+
+class NetworkPolicy(object):
+    '''How git commands that talk to a remote are run: transfers that stall
+    are aborted by git itself, each operation can get a timeout, and failures
+    that look transient are retried with exponential backoff. Operations
+    that time out are remembered, so they can be reported at the end.'''
+
+    # messages of failures worth retrying, as opposed to eg. a missing repo
+    # or failed authentication
+    transient_errors = [
+        'could not resolve host',
+        'connection timed out',
+        'connection reset',
+        'connection refused',
+        'connection closed',
+        'operation timed out',
+        'early eof',
+        'the remote end hung up unexpectedly',
+        'rpc failed',
+        'transfer rate too low',
+        'temporary failure in name resolution',
+        'timed out after',
+    ]
+
+    def __init__(self, timeout=None, timeouts=None, low_speed_limit=None,
+                 low_speed_time=None, retries=None, backoff=None):
+        self.timeout = timeout
+        self.timeouts = timeouts or {}  # operation -> seconds
+        self.low_speed_limit = low_speed_limit
+        self.low_speed_time = low_speed_time
+        self.retries = retries or 0
+        self.backoff = backoff or 0
+        self.timed_out = []  # (path, operation, timeout)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        operations = ['fetch', 'clone', 'ls_remote']
+        timeouts = {}
+        for operation in operations:
+            timeouts[operation] = settings.get_int('network.timeout.%s' % operation)
+        return cls(
+            timeout=settings.get_int('network.timeout', consts.NETWORK_TIMEOUT),
+            timeouts=timeouts,
+            low_speed_limit=settings.get_int('network.low_speed_limit',
+                                             consts.NETWORK_LOW_SPEED_LIMIT),
+            low_speed_time=settings.get_int('network.low_speed_time',
+                                            consts.NETWORK_LOW_SPEED_TIME),
+            retries=settings.get_int('network.retries', consts.NETWORK_RETRIES),
+            backoff=settings.get_int('network.backoff', consts.NETWORK_BACKOFF),
+        )
+
+    def get_timeout(self, operation):
+        timeout = self.timeouts.get(operation)
+        if timeout is None:
+            timeout = self.timeout
+        return timeout or None
+
+    def get_args(self, args):
+        '''Adds the options that make git abort a stalled http transfer.'''
+        if not (self.low_speed_limit and self.low_speed_time):
+            return args
+        return args[:1] + [
+            '-c', 'http.lowSpeedLimit=%s' % self.low_speed_limit,
+            '-c', 'http.lowSpeedTime=%s' % self.low_speed_time,
+        ] + args[1:]
+
+    def is_transient(self, ret, err):
+        if ret == ioutils.TIMED_OUT:
+            return True
+        err = str(err).lower()
+        return any(msg in err for msg in self.transient_errors)
+
+    def get_delay(self, attempt):
+        '''Exponential backoff with jitter, so that repos that failed together
+        do not all retry at the same moment.'''
+        delay = self.backoff * (2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def should_retry(self, attempt, ret, err):
+        return attempt < self.retries and self.is_transient(ret, err)
+
+    def record_timeout(self, path, operation, ret):
+        if ret == ioutils.TIMED_OUT:
+            with self.lock:
+                self.timed_out.append((path, operation, self.get_timeout(operation)))
+
+    def run(self, path, operation, args, before_retry=None):
+        '''Runs a git command that talks to a remote, returns the result of
+        the last attempt.'''
+        args = self.get_args(args)
+        timeout = self.get_timeout(operation)
+        attempt = 0
+        while True:
+            ret, out, err = ioutils.invoke(path, args, timeout=timeout)
+            if not ret:
+                return ret, out, err
+
+            if not self.should_retry(attempt, ret, err):
+                self.record_timeout(path, operation, ret)
+                return ret, out, err
+
+            delay = self.get_delay(attempt)
+            logger.info("Retrying %s for '%s' after: %s" % (operation, path, err))
+            ioutils.complain('Retrying %s of %s in %.1fs' % (operation, path, delay),
+                             minor=True)
+            time.sleep(delay)
+            attempt += 1
+            if before_retry:
+                before_retry()
+
+    def report(self):
+        if not self.timed_out:
+            return
+        ioutils.complain('Timed out:')
+        for path, operation, timeout in self.timed_out:
+            ioutils.complain('%s: %s after %ss' % (path, operation, timeout), minor=True)
@@ -0,0 +1,161 @@
+'''A pull engine on asyncio, where every repo moves through the stages of a
+pull on its own. Python 3 only.'''
+
+from __future__ import absolute_import
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from reps import aioutils
+from reps import ioutils
+from reps.backends import Git
+
+logger = logging
+
+
+class RepoState(object):
+    INIT = 'init'
+    FETCH = 'fetch'
+    MERGE = 'merge'
+    DEFERRED = 'deferred'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class PullPipeline(object):
+    '''Pulls repos so that a fast repo is merged while slow ones are still
+    fetching. Each repo goes through init and remote setup, fetch, branch
+    detection and merge independently. Fetches run as async subprocesses,
+    with the same limits per host and url as JobPool.map. Local work runs
+    on a thread pool, with its output printed as a unit.
+
+    Merges that may need the user, to answer a prompt or to resolve a
+    conflict, are queued and run one at a time once everything else is
+    done.
+
+    mirrors maps each repo to the MirrorCache it fetches through, if any.'''
+
+    def __init__(self, repos, jobs=1, key=None, key_limit=None, registry=None,
+                 mirrors=None):
+        self.repos = list(repos)
+        self.jobs = max(1, jobs or 1)
+        self.key = key
+        self.key_limit = key_limit
+        self.registry = registry
+        self.mirrors = mirrors
+
+        self.states = {}
+        self.deferred = []  # (repo, reason)
+
+    def run(self):
+        '''Pulls all the repos, returns whether each one succeeded.'''
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            loop.run_until_complete(self.pull_all(loop, executor))
+        finally:
+            executor.shutdown()
+            loop.close()
+
+        self.run_deferred()
+        return [self.states.get(repo) != RepoState.FAILED for repo in self.repos]
+
+    async def pull_all(self, loop, executor):
+        self.loop = loop
+        self.executor = executor
+        self.fetch_slots = asyncio.Semaphore(self.jobs)
+        self.key_slots = {}
+        await asyncio.gather(*[self.pull_repo(repo) for repo in self.repos])
+
+    async def in_thread(self, func, *args):
+        def stage():
+            ioutils.start_buffering()
+            try:
+                return func(*args)
+            finally:
+                ioutils.flush(ioutils.stop_buffering())
+        return await self.loop.run_in_executor(self.executor, stage)
+
+    async def pull_repo(self, repo):
+        try:
+            self.states[repo] = RepoState.INIT
+            tips_before = await self.in_thread(repo.prepare_fetch)
+
+            self.states[repo] = RepoState.FETCH
+            success = await self.fetch_repo(repo)
+            if not await self.in_thread(repo.finish_fetch, tips_before, success):
+                self.states[repo] = RepoState.FAILED
+                return
+
+            self.states[repo] = RepoState.MERGE
+            if not await self.in_thread(repo.needs_merge):
+                logger.info('Nothing to merge in %s' % repo.location)
+                self.states[repo] = RepoState.DONE
+                return
+
+            reason = await self.in_thread(repo.needs_interaction)
+            if reason:
+                self.states[repo] = RepoState.DEFERRED
+                self.deferred.append((repo, reason))
+                return
+
+            await self.in_thread(repo.cmd_merge)
+            self.states[repo] = RepoState.DONE
+
+        except Exception as e:
+            logger.debug('Pulling %s failed' % repo.location, exc_info=True)
+            ioutils.complain('Failed pulling %s: %s' % (repo.location, e))
+            self.states[repo] = RepoState.FAILED
+
+    def get_key_slot(self, key):
+        if key not in self.key_slots:
+            limit = self.key_limit and self.key_limit(key)
+            self.key_slots[key] = limit and asyncio.Semaphore(limit) or None
+        return self.key_slots[key]
+
+    async def fetch_repo(self, repo):
+        # take the slots in a fixed order, so that repos sharing keys cannot
+        # wait on each other
+        keys = sorted(set(self.key and self.key(repo) or []))
+        held = []
+        try:
+            for key in keys:
+                slot = self.get_key_slot(key)
+                if slot:
+                    await slot.acquire()
+                    held.append(slot)
+
+            async with self.fetch_slots:
+                ioutils.inform('Fetching %s' % repo.location)
+                success = True
+                for remote in repo.remotes.values():
+                    success = success and await self.fetch_remote(remote)
+                return success
+        finally:
+            for slot in held:
+                slot.release()
+
+    async def fetch_remote(self, remote):
+        '''The async counterpart of Remote.cmd_fetch.'''
+        repo = remote.repo
+        # updating a mirror waits on a lock, so the plan is made in a thread
+        mirrors = self.mirrors and self.mirrors.get(repo)
+        plan = await self.in_thread(remote.plan_fetch, self.registry, mirrors)
+        if plan.network:
+            ret, out, err = await aioutils.run_network(Git.network, repo.location,
+                                                       'fetch', plan.args)
+        else:
+            ret, out, err = await aioutils.invoke(repo.location, plan.args)
+        return remote.complete_fetch(plan, ret, err)
+
+    def run_deferred(self):
+        for repo, reason in self.deferred:
+            ioutils.complain('Merging %s needs attention: %s' % (repo.location, reason))
+            try:
+                repo.cmd_merge()
+                self.states[repo] = RepoState.DONE
+            except Exception as e:
+                logger.debug('Merging %s failed' % repo.location, exc_info=True)
+                ioutils.complain('Failed merging %s: %s' % (repo.location, e))
+                self.states[repo] = RepoState.FAILED
@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+import threading
+import time
+
+import reps
+
+
+class Invocation(object):
+    def __init__(self, repo, args, caller, phase, start, elapsed, ret, out_size):
+        self.repo = repo
+        self.args = args
+        self.caller = caller
+        self.phase = phase
+        self.start = start
+        self.elapsed = elapsed
+        self.ret = ret
+        self.out_size = out_size
+        self.thread = threading.current_thread().ident
+
+    @property
+    def subcommand(self):
+        '''The git subcommand, eg. fetch for git -c x=y fetch origin.'''
+        args = list(self.args)
+        if not args or os.path.basename(args[0]) != 'git':
+            return args and os.path.basename(args[0]) or ''
+
+        args.pop(0)
+        while args and args[0].startswith('-'):
+            opt = args.pop(0)
+            # options that take their value as the next argument
+            if opt in ('-c', '-C') and args:
+                args.pop(0)
+        return args and args[0] or 'git'
+
+
+class Profiler(object):
+    '''Records every command run through ioutils.invoke, along with the
+    model methods that caused it, and summarizes where the time went.'''
+
+    package_dir = os.path.dirname(os.path.abspath(reps.__file__))
+    model_dir = os.path.join(package_dir, 'model')
+    pipeline_file = os.path.join(package_dir, 'pipeline.py')
+    top = 10
+
+    def __init__(self):
+        self.started = time.time()
+        self.invocations = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def find_callers(cls, frame):
+        '''Returns the innermost and outermost model methods on the stack,
+        eg. detect_tracking and cmd_fetch. Commands run by the pull pipeline
+        outside of the model are attributed to its stages.'''
+        model, pipeline = [], []
+        while frame is not None:
+            filepath = os.path.abspath(frame.f_code.co_filename)
+            if os.path.dirname(filepath) == cls.model_dir:
+                model.append(frame.f_code.co_name)
+            elif filepath == cls.pipeline_file:
+                # the stages of a repo are the frames below pull_repo
+                if frame.f_code.co_name == 'pull_repo':
+                    pipeline = pipeline or ['pull_repo']
+                    break
+                pipeline.append(frame.f_code.co_name)
+            frame = frame.f_back
+
+        names = model or pipeline
+        if not names:
+            return '?', '?'
+        return names[0], names[-1]
+
+    def record(self, cwd, args, start, elapsed, ret, out_size):
+        caller, phase = self.find_callers(sys._getframe(1))
+        inv = Invocation(cwd, args, caller, phase, start, elapsed, ret, out_size)
+        with self.lock:
+            self.invocations.append(inv)
+
+    def aggregate(self, keyfunc):
+        '''Returns (key, count, total time) sorted by total time.'''
+        totals = {}
+        for inv in self.invocations:
+            count, elapsed = totals.get(keyfunc(inv), (0, 0.0))
+            totals[keyfunc(inv)] = (count + 1, elapsed + inv.elapsed)
+        rows = [(key, count, elapsed) for key, (count, elapsed) in totals.items()]
+        return sorted(rows, key=lambda row: (-row[2], row[0]))
+
+    def format_table(self, title, rows):
+        lines = ['%-32s %7s %10s %10s' % (title, 'count', 'total', 'mean')]
+        for key, count, elapsed in rows[:self.top]:
+            lines.append('%-32s %7d %9.3fs %9.3fs' %
+                         (key, count, elapsed, elapsed / count))
+        return lines
+
+    def report(self, filehandle=None):
+        filehandle = filehandle or sys.stderr
+
+        wall = time.time() - self.started
+        total = sum(inv.elapsed for inv in self.invocations)
+        failed = len([inv for inv in self.invocations if inv.ret])
+        out_size = sum(inv.out_size for inv in self.invocations)
+
+        lines = ['',
+                 'Profile: %d commands (%d failed) taking %.3fs, %d bytes of output, '
+                 'in %.3fs wall time' % (len(self.invocations), failed, total,
+                                         out_size, wall),
+                 '']
+        lines.extend(self.format_table('Subcommand',
+                                       self.aggregate(lambda inv: inv.subcommand)))
+        lines.append('')
+        lines.extend(self.format_table('Phase',
+                                       self.aggregate(lambda inv: inv.phase)))
+        lines.append('')
+        lines.extend(self.format_table('Caller',
+                                       self.aggregate(lambda inv: inv.caller)))
+        lines.append('')
+        lines.extend(self.format_table('Slowest repos',
+                                       self.aggregate(lambda inv: inv.repo)))
+
+        filehandle.write('\n'.join(lines) + '\n')
+
+    def write_trace(self, filepath):
+        '''Writes the invocations in the Chrome trace event format, which can
+        be loaded in chrome://tracing or Perfetto.'''
+        threads = {}
+        events = []
+        for inv in sorted(self.invocations, key=lambda inv: inv.start):
+            tid = threads.setdefault(inv.thread, len(threads) + 1)
+            events.append({
+                'name': '%s %s' % (inv.subcommand, inv.repo),
+                'cat': inv.phase,
+                'ph': 'X',
+                'ts': int((inv.start - self.started) * 1e6),
+                'dur': int(inv.elapsed * 1e6),
+                'pid': 1,
+                'tid': tid,
+                'args': {
+                    'repo': inv.repo,
+                    'command': ' '.join(inv.args),
+                    'caller': inv.caller,
+                    'phase': inv.phase,
+                    'exit_code': inv.ret,
+                    'output_bytes': inv.out_size,
+                },
+            })
+
+        with open(filepath, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
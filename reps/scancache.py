@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import threading
+import time
+
+from reps import consts
+from reps.compat import scandir
+
+logger = logging
+
+
+class ScanCache(object):
+    '''Remembers the directory listings and repo remotes seen by a scan, so
+    that a re-scan only lists directories whose mtime changed and only
+    inspects repos whose config changed. Without a filepath the cache only
+    lives in memory. Paths are relative to root, if given.'''
+
+    version = 1
+
+    # entries modified this close to the time of the scan could still change
+    # within the same mtime tick, so they are not cached
+    racy_window = 2
+
+    def __init__(self, filepath=None, root=None):
+        self.filepath = filepath
+        self.root = root
+        self.dirs = {}
+        self.repos = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath, root=None):
+        cache = cls(filepath, root=root)
+        if not os.path.exists(filepath):
+            return cache
+
+        try:
+            with open(filepath) as fp:
+                dct = json.load(fp)
+        except (IOError, ValueError):
+            logger.warn('Could not read scan cache %s' % filepath)
+            return cache
+
+        if dct.get('version') == cls.version:
+            cache.dirs = dct.get('dirs', {})
+            cache.repos = dct.get('repos', {})
+        return cache
+
+    def save(self):
+        if not self.filepath:
+            return
+
+        dct = {
+            'version': self.version,
+            'dirs': self.dirs,
+            'repos': self.repos,
+        }
+        tmppath = '%s.tmp' % self.filepath
+        try:
+            with open(tmppath, 'w') as fp:
+                json.dump(dct, fp)
+            os.rename(tmppath, self.filepath)
+        except (IOError, OSError):
+            logger.warn('Could not write scan cache %s' % self.filepath)
+
+    def is_racy(self, mtime):
+        return mtime is None or mtime >= self.started - self.racy_window
+
+    def list_dir(self, path):
+        '''Returns the subdirectories of path as (name, is_link) pairs and
+        whether path contains a .reconfig marker.'''
+        fullpath = os.path.join(self.root, path) if self.root else path
+        try:
+            mtime = os.stat(fullpath).st_mtime
+        except OSError:
+            return [], False
+
+        entry = self.dirs.get(path)
+        if entry and entry['mtime'] == mtime:
+            return entry['dirs'], entry['marker']
+
+        dirs, marker = [], False
+        for name, is_dir, is_link in self.read_dir(fullpath):
+            if is_dir:
+                dirs.append((name, is_link))
+            elif name == consts.REPO_CONFIG:
+                marker = True
+
+        with self.lock:
+            if self.is_racy(mtime):
+                self.dirs.pop(path, None)
+            else:
+                self.dirs[path] = {'mtime': mtime, 'dirs': dirs, 'marker': marker}
+        return dirs, marker
+
+    def read_dir(self, path):
+        '''Yields (name, is_dir, is_link) for the entries of path, where
+        is_dir follows symlinks like os.walk does.'''
+        try:
+            if scandir:
+                for entry in scandir(path):
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    yield entry.name, is_dir, entry.is_symlink()
+            else:
+                for name in os.listdir(path):
+                    fullpath = os.path.join(path, name)
+                    yield name, os.path.isdir(fullpath), os.path.islink(fullpath)
+        except OSError:
+            return
+
+    def get_repo(self, path, stamp):
+        entry = self.repos.get(path)
+        if entry and stamp is not None and entry['stamp'] == stamp:
+            return entry['remotes']
+
+    def set_repo(self, path, stamp, remotes):
+        with self.lock:
+            if self.is_racy(stamp):
+                self.repos.pop(path, None)
+            else:
+                self.repos[path] = {'stamp': stamp, 'remotes': remotes}
@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+from reps.compat import OrderedDict
+
+
+class Settings(OrderedDict):
+    '''Workspace wide settings, read from the [settings] section of the
+    config. Values are stored as strings and converted on lookup.'''
+
+    def get_str(self, key, default=None):
+        val = self.get(key)
+        if val is None or val == '':
+            return default
+        return val
+
+    def get_int(self, key, default=None):
+        val = self.get_str(key)
+        if val is None:
+            return default
+        try:
+            return int(val)
+        except ValueError:
+            return default
+
+    def get_bool(self, key, default=False):
+        val = self.get_str(key)
+        if val is None:
+            return default
+        return val.lower() in ('1', 'true', 'yes', 'on')
+
+    def get_list(self, key, default=None):
+        val = self.get_str(key)
+        if val is None:
+            return default or []
+        return [item for item in val.split(',') if item]
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import shutil
+import tempfile
+
+from reps import consts
+from reps import ioutils
+
+logger = logging
+
+
+class SshMultiplexer(object):
+    '''Makes every ssh connection that git opens during a run go through one
+    multiplexed master connection per host, so that the handshake is only
+    paid once per host. Connections send keepalives, so that one that
+    stalls is dropped instead of hanging. Leaves ssh alone if the user has
+    configured their own ssh command.'''
+
+    env_keys = ['GIT_SSH', 'GIT_SSH_COMMAND']
+
+    def __init__(self, persist=None, keepalive=None, multiplex=True):
+        self.persist = persist or consts.SSH_CONTROL_PERSIST
+        self.keepalive = keepalive or consts.SSH_KEEPALIVE
+        self.multiplex = multiplex
+        self.control_dir = None
+        self.started = False
+
+    def start(self):
+        if any(os.environ.get(key) for key in self.env_keys):
+            logger.info('Not setting ssh options, ssh command set by user')
+            return
+
+        args = [
+            'ssh',
+            '-o ServerAliveInterval=%s' % self.keepalive,
+            '-o ServerAliveCountMax=3',
+        ]
+        if self.multiplex:
+            # keep the path short, unix socket paths are limited to ~100 chars
+            self.control_dir = tempfile.mkdtemp(prefix='re-ssh-')
+            control_path = os.path.join(self.control_dir, '%C')
+            args += [
+                '-o ControlMaster=auto',
+                '-o ControlPath=%s' % control_path,
+                '-o ControlPersist=%s' % self.persist,
+            ]
+        os.environ['GIT_SSH_COMMAND'] = ' '.join(args)
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+
+        os.environ.pop('GIT_SSH_COMMAND', None)
+        self.started = False
+        if not self.control_dir:
+            return
+
+        # shut down the master connections
+        for name in os.listdir(self.control_dir):
+            socket = os.path.join(self.control_dir, name)
+            ioutils.invoke(self.control_dir, ['ssh', '-S', socket, '-O', 'exit', 'host'])
+
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,12 +1,34 @@
 import os
 import re
+import sys
 
 from setuptools import find_packages
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 import reps
 
 
+# modules written with async def, which older pythons cannot even compile.
+# They are only imported on python 3.5 or later
+ASYNC_MODULES = [
+    ('reps', 'aioutils'),
+    ('reps', 'pipeline'),
+]
+
+
+class BuildPy(build_py):
+    '''Leaves the async modules out of builds for older pythons, so that they
+    are not byte-compiled on install.'''
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [(pkg, mod, path) for pkg, mod, path in modules
+                       if (pkg, mod) not in ASYNC_MODULES]
+        return modules
+
+
 setup(
     name='reps',
     version=reps.__version__,
@@ -15,7 +37,7 @@ setup(
     author_email='numerodix@gmail.com',
     url='https://github.com/numerodix/re',
 
-    packages=find_packages('.'),
+    packages=find_packages('.', exclude=['tests', 'tests.*']),
     package_dir={'': '.'},
 
     install_requires=[
@@ -26,6 +48,8 @@ setup(
     # don't install as zipped egg
     zip_safe=False,
 
+    cmdclass={'build_py': BuildPy},
+
     scripts=[
         'bin/re',
     ],
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from reps.compat import OrderedDict
+from reps.fetchregistry import FetchRegistry
+from reps.model.git import GitRepo
+
+
+URL = 'https://example.com/repo.git'
+
+
+class TestFetchRegistry(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.registry = FetchRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_remote(self, path, **options):
+        subprocess.check_call(['git', 'init', '-q', os.path.join(self.root, path)])
+        attributes = OrderedDict([('origin.url', URL)])
+        for key, val in options.items():
+            attributes['origin.%s' % key] = val
+        repo = GitRepo.from_cfg_attributes(path, attributes, root=self.root)
+        return repo.remotes['origin']
+
+    def location(self, path):
+        return os.path.abspath(os.path.join(self.root, path))
+
+    def fetch(self, remote):
+        '''Plans a fetch and records it as succeeded.'''
+        plan = remote.plan_fetch(registry=self.registry)
+        remote.complete_fetch(plan, 0, '')
+        return plan
+
+    def test_first_fetch_registers(self):
+        plan = self.fetch(self.make_remote('a'))
+        self.assertTrue(plan.network)
+        self.assertEqual((self.location('a'), 'origin'), self.registry.get_source(URL))
+
+    def test_fetch_from_local_source(self):
+        self.fetch(self.make_remote('a'))
+        plan = self.fetch(self.make_remote('b'))
+        self.assertFalse(plan.network)
+        self.assertEqual(self.location('a'), plan.source)
+        self.assertEqual(['git', 'fetch', '--prune', '--tags', self.location('a'),
+                          '+refs/remotes/origin/*:refs/remotes/origin/*'], plan.args)
+        # the first repo stays the source
+        self.assertEqual((self.location('a'), 'origin'), self.registry.get_source(URL))
+
+    def test_tags_from_local_source(self):
+        self.fetch(self.make_remote('a'))
+        plan = self.fetch(self.make_remote('b', tags='none'))
+        self.assertIn('--no-tags', plan.args)
+        plan = self.fetch(self.make_remote('c', branches='master'))
+        self.assertIn('--no-tags', plan.args)
+        plan = self.fetch(self.make_remote('d', branches='master', tags='all'))
+        self.assertIn('--tags', plan.args)
+
+    def test_branch_filter_not_registered(self):
+        # a repo that leaves branches out cannot stand in for the remote
+        plan = self.fetch(self.make_remote('a', exclude='dev'))
+        self.assertTrue(plan.network)
+        self.assertEqual(None, self.registry.get_source(URL))
+
+    def test_branch_filter_fetches_locally(self):
+        self.fetch(self.make_remote('a'))
+        plan = self.fetch(self.make_remote('b', branches='master'))
+        self.assertFalse(plan.network)
+        self.assertIn('+refs/remotes/origin/master:refs/remotes/origin/master', plan.args)
+
+    def test_narrowed_skips_registry(self):
+        self.fetch(self.make_remote('a'))
+        for options in ({'depth': '1'}, {'filter': 'blobless'},
+                        {'single_branch': 'master'}):
+            plan = self.fetch(self.make_remote('b', **options))
+            self.assertTrue(plan.network)
+        self.assertEqual((self.location('a'), 'origin'), self.registry.get_source(URL))
+
+    def test_failed_fetch_not_registered(self):
+        remote = self.make_remote('a')
+        plan = remote.plan_fetch(registry=self.registry)
+        remote.complete_fetch(plan, 1, 'error')
+        self.assertEqual(None, self.registry.get_source(URL))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+
+import unittest
+
+from reps.model.gitcompact import CompactAction
+from reps.model.gitcompact import CompactPolicy
+from reps.settings import Settings
+
+
+class TestCompactPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = CompactPolicy(max_loose=100, max_packs=50)
+
+    def test_compact_repo(self):
+        stats = {'count': 0, 'packs': 1, 'prune-packable': 0, 'garbage': 0}
+        self.assertEqual(None, self.policy.choose(stats))
+
+    def test_too_many_packs(self):
+        stats = {'count': 500, 'packs': 51}
+        self.assertEqual(CompactAction.GEOMETRIC, self.policy.choose(stats))
+
+    def test_too_many_loose(self):
+        self.assertEqual(CompactAction.REPACK, self.policy.choose({'count': 101}))
+        self.assertEqual(None, self.policy.choose({'count': 100}))
+
+    def test_unreachable_loose_are_pruned(self):
+        # loose objects left over by a repack are unreachable
+        self.assertEqual(CompactAction.PRUNE, self.policy.choose_next({'count': 300}))
+        self.assertEqual(None, self.policy.choose_next({'count': 100}))
+
+    def test_prune_packable(self):
+        stats = {'count': 10, 'prune-packable': 10}
+        self.assertEqual(CompactAction.PRUNE_PACKED, self.policy.choose(stats))
+
+    def test_garbage_is_pruned(self):
+        stats = {'count': 0, 'packs': 1, 'garbage': 1, 'size-garbage': 4}
+        self.assertEqual(CompactAction.PRUNE, self.policy.choose(stats))
+        self.assertEqual(CompactAction.PRUNE, self.policy.choose_next(stats))
+
+    def test_garbage_threshold(self):
+        policy = CompactPolicy(max_garbage=5)
+        self.assertEqual(None, policy.choose({'garbage': 5}))
+        self.assertEqual(CompactAction.PRUNE, policy.choose({'garbage': 6}))
+
+    def test_packs_before_loose(self):
+        stats = {'count': 500, 'packs': 51, 'garbage': 1}
+        self.assertEqual(CompactAction.GEOMETRIC, self.policy.choose(stats))
+
+    def test_no_loose_limit(self):
+        policy = CompactPolicy(max_loose=0)
+        self.assertEqual(CompactAction.REPACK, policy.choose({'count': 1}))
+        self.assertEqual(None, policy.choose({'count': 0}))
+
+    def test_from_settings(self):
+        settings = Settings()
+        settings['compact.max_loose'] = '5'
+        policy = CompactPolicy.from_settings(settings)
+        self.assertEqual(5, policy.max_loose)
+        self.assertEqual(50, policy.max_packs)
+        self.assertEqual(0, policy.max_garbage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+from __future__ import absolute_import
+
+import subprocess
+import unittest
+
+from reps.model.gitconfig import ConfigCache
+from tests.test_gitnative import GitRepoTestCase
+
+
+class TestConfigCache(GitRepoTestCase):
+    def test_update(self):
+        config = ConfigCache(self.path)
+        self.assertEqual(2, config.update([('user.name', 'x'), ('remote.Up.url', 'u')]))
+        # unchanged keys are not written again
+        self.assertEqual(1, config.update([('User.Name', 'x'), ('remote.Up.URL', 'v')]))
+        self.assertEqual('v', config.get('remote.Up.url'))
+        self.assertEqual(None, config.get('remote.up.url'))
+
+        # what was written is what git reads
+        fresh = ConfigCache(self.path)
+        self.assertEqual('x', fresh.get('user.name'))
+        self.assertEqual(['v'], self.get_all('remote.Up.url'))
+
+    def test_update_all(self):
+        config = ConfigCache(self.path)
+        refspecs = ['+refs/heads/master:refs/remotes/origin/master',
+                    '^refs/heads/dev']
+        self.assertTrue(config.update_all('remote.origin.fetch', refspecs))
+        self.assertFalse(config.update_all('remote.origin.fetch', refspecs))
+        self.assertEqual(refspecs, self.get_all('remote.origin.fetch'))
+        self.assertEqual(refspecs, ConfigCache(self.path).get_all('remote.origin.fetch'))
+
+        self.assertTrue(config.update_all('remote.origin.fetch', []))
+        self.assertEqual([], self.get_all('remote.origin.fetch'))
+        self.assertEqual([], config.get_all('remote.origin.fetch'))
+
+    def test_update_after_update_all(self):
+        config = ConfigCache(self.path)
+        config.update_all('remote.origin.fetch', ['a', 'b'])
+        config.update([('remote.origin.fetch', 'c'), ('remote.origin.url', 'u')])
+        self.assertEqual(['c'], self.get_all('remote.origin.fetch'))
+        self.assertEqual(['u'], self.get_all('remote.origin.url'))
+        self.assertEqual(0, subprocess.call(['git', 'config', '--list'], cwd=self.path,
+                                            stdout=subprocess.PIPE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from reps.backends.gitconfigfile import GitConfigFile
+from reps.backends.gitconfigfile import UnsupportedConfig
+
+
+def git_list(path):
+    '''The pairs of git config --local --includes --list, for comparison.'''
+    out = subprocess.check_output(['git', 'config', '--local', '--includes', '--list', '-z'],
+                                  cwd=path).decode('utf-8')
+    pairs = []
+    for entry in out.split('\0'):
+        if entry:
+            key, _, value = entry.partition('\n')
+            pairs.append((key, value))
+    return pairs
+
+
+class TestParseText(unittest.TestCase):
+    def parse(self, text):
+        return list(GitConfigFile.parse_text(text))
+
+    def test_sections(self):
+        text = u'[Core]\n\tBare = false\n[remote "Origin"]\n\turl = x\n[Branch.Master]\nk\n'
+        self.assertEqual([
+            ('core.bare', 'false'),
+            ('remote.Origin.url', 'x'),
+            ('branch.master.k', ''),
+        ], self.parse(text))
+
+    def test_values(self):
+        text = (u'[a]\n'
+                u'  q = " two  spaces " # comment\n'
+                u'  e = tab\\there \\"quoted\\" back\\\\slash\n'
+                u'  c = value ; comment\n'
+                u'  l = one \\\n  two\n')
+        self.assertEqual([
+            ('a.q', ' two  spaces '),
+            ('a.e', 'tab\there "quoted" back\\slash'),
+            ('a.c', 'value'),
+            ('a.l', 'one   two'),
+        ], self.parse(text))
+
+    def test_non_ascii_key(self):
+        self.assertRaises(UnsupportedConfig, self.parse, u'[a]\n\té = 1\n')
+
+    def test_bad_config(self):
+        self.assertRaises(UnsupportedConfig, self.parse, u'k = 1\n')
+        self.assertRaises(UnsupportedConfig, self.parse, u'[a\n')
+        self.assertRaises(UnsupportedConfig, self.parse, u'[a]\n k = "open\n')
+        self.assertRaises(UnsupportedConfig, self.parse, u'[a]\n k = \\x\n')
+
+
+class TestReadRepoConfig(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        subprocess.check_call(['git', 'init', '-q', self.path])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def append(self, text):
+        with io.open(os.path.join(self.path, '.git', 'config'), 'a', encoding='utf-8') as fp:
+            fp.write(text)
+
+    def test_same_as_git(self):
+        self.append(u'[remote "Up"]\n'
+                    u'\turl = "/tmp/a b"  ; comment\n'
+                    u'\tfetch = +refs/heads/*:refs/remotes/Up/*\n'
+                    u'\tFetch = ^refs/heads/dev\n'
+                    u'[Core]\n'
+                    u'\tEditor = "vi \\"-c\\" set\\tx"\n'
+                    u'[remote "Up"]\n'
+                    u'\tmirror\n')
+        self.assertEqual(git_list(self.path), GitConfigFile.read_repo_config(self.path))
+
+    def test_include(self):
+        with io.open(os.path.join(self.path, '.git', 'extra'), 'w', encoding='utf-8') as fp:
+            fp.write(u'[user]\n\tname = x\n')
+        self.append(u'[include]\n\tpath = extra\n')
+        self.assertEqual(git_list(self.path), GitConfigFile.read_repo_config(self.path))
+
+    def test_conditional_include(self):
+        self.append(u'[includeIf "gitdir:/x/"]\n\tpath = extra\n')
+        self.assertEqual(None, GitConfigFile.read_repo_config(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
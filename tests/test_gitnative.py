@@ -0,0 +1,196 @@
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from reps.backends.gitnative import GitNative
+
+
+def git_config(path, *args):
+    try:
+        out = subprocess.check_output(['git', 'config'] + list(args), cwd=path)
+    except subprocess.CalledProcessError:
+        return None
+    return out.decode('utf-8')
+
+
+class GitRepoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        subprocess.check_call(['git', 'init', '-q', self.path])
+        self.config_path = os.path.join(self.path, '.git', 'config')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_config(self):
+        with io.open(self.config_path, encoding='utf-8') as fp:
+            return fp.read()
+
+    def append_config(self, text):
+        with io.open(self.config_path, 'a', encoding='utf-8') as fp:
+            fp.write(text)
+
+    def get_all(self, key):
+        out = git_config(self.path, '--null', '--get-all', key)
+        return out is not None and out.split('\0')[:-1] or []
+
+
+class TestSetConfKeys(GitRepoTestCase):
+    def test_values(self):
+        values = [
+            ('a.plain', 'value'),
+            ('a.spaces', ' leading and trailing '),
+            ('a.quotes', 'say "hi"'),
+            ('a.escapes', 'back\\slash\ttab\nnewline'),
+            ('a.comment', 'x # not a comment ; either'),
+            ('a.empty', ''),
+        ]
+        GitNative.set_conf_keys(self.path, values)
+        for key, value in values:
+            self.assertEqual([value], self.get_all(key))
+
+    def test_replace_in_place(self):
+        self.append_config(u'[remote "origin"]\n'
+                           u'\turl = old ; trailing comment\n'
+                           u'\t# a comment\n'
+                           u'\tfetch = +refs/heads/*:refs/remotes/origin/*\n')
+        GitNative.set_conf_keys(self.path, [('remote.origin.url', 'new')])
+        self.assertEqual(['new'], self.get_all('remote.origin.url'))
+        text = self.read_config()
+        self.assertEqual(1, text.count('[remote "origin"]'))
+        self.assertTrue(text.index('url = new') < text.index('# a comment'))
+
+    def test_case(self):
+        # section and variable names are case insensitive, subsections not
+        self.append_config(u'[Remote "Up"]\n\tURL = old\n')
+        GitNative.set_conf_keys(self.path, [
+            ('remote.Up.url', 'new'),
+            ('REMOTE.up.Url', 'other'),
+            ('Core.Editor', 'vi'),
+        ])
+        self.assertEqual(['new'], self.get_all('remote.Up.url'))
+        self.assertEqual(['other'], self.get_all('remote.up.url'))
+        self.assertEqual(['vi'], self.get_all('core.editor'))
+        text = self.read_config()
+        self.assertEqual(1, text.count('[core]'))
+        self.assertEqual(1, text.count('[Remote "Up"]'))
+
+    def test_subsection_escapes(self):
+        GitNative.set_conf_keys(self.path, [('branch.a"b\\c.remote', 'origin')])
+        self.assertEqual(['origin'], self.get_all('branch.a"b\\c.remote'))
+
+    def test_repeated_sections(self):
+        self.append_config(u'[branch "master"]\n\tremote = origin\n'
+                           u'[user]\n\tname = x\n'
+                           u'[branch "master"]\n\tmerge = refs/heads/master\n'
+                           u'\tmerge = refs/heads/other\n')
+        GitNative.set_conf_keys(self.path, [
+            ('branch.master.merge', 'refs/heads/dev'),
+            ('branch.master.rebase', 'true'),
+        ])
+        # a multi-valued key ends up with the one value
+        self.assertEqual(['refs/heads/dev'], self.get_all('branch.master.merge'))
+        self.assertEqual(['origin'], self.get_all('branch.master.remote'))
+        self.assertEqual(['true'], self.get_all('branch.master.rebase'))
+        self.assertEqual(2, self.read_config().count('[branch "master"]'))
+
+    def test_no_trailing_newline(self):
+        self.append_config(u'[user]\n\tname = x')
+        GitNative.set_conf_keys(self.path, [('user.email', 'x@y')])
+        self.assertEqual(['x'], self.get_all('user.name'))
+        self.assertEqual(['x@y'], self.get_all('user.email'))
+
+    def test_lock_held(self):
+        # another writer holds the lock: the config and the lock are left
+        # alone
+        lockpath = '%s.lock' % self.config_path
+        with open(lockpath, 'w'):
+            pass
+        before = self.read_config()
+        GitNative.set_conf_keys(self.path, [('user.name', 'x')])
+        self.assertTrue(os.path.exists(lockpath))
+        self.assertEqual(before, self.read_config())
+
+    def test_no_lock_left(self):
+        GitNative.set_conf_keys(self.path, [('user.name', 'x')])
+        self.assertFalse(os.path.exists('%s.lock' % self.config_path))
+
+    def test_continued_value(self):
+        # left to git, which writes the key all the same
+        self.append_config(u'[user]\n\tname = a \\\n b\n')
+        GitNative.set_conf_keys(self.path, [('user.email', 'x@y')])
+        self.assertEqual(['x@y'], self.get_all('user.email'))
+        self.assertEqual(['a  b'], self.get_all('user.name'))
+
+
+class TestReadRefs(GitRepoTestCase):
+    def setUp(self):
+        super(TestReadRefs, self).setUp()
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/master')
+        self.first = self.commit('first')
+        self.git('branch', 'feature')
+        self.git('-c', 'user.name=x', '-c', 'user.email=x@y',
+                 'tag', '-a', '-m', 'annotated', 'v1')
+        self.git('update-ref', 'refs/remotes/origin/master', self.first)
+        self.git('symbolic-ref', 'refs/remotes/origin/HEAD', 'refs/remotes/origin/master')
+
+    def git(self, *args):
+        return subprocess.check_output(['git'] + list(args), cwd=self.path).decode('utf-8')
+
+    def commit(self, message):
+        self.git('-c', 'user.name=x', '-c', 'user.email=x@y',
+                 'commit', '-q', '--allow-empty', '-m', message)
+        return self.git('rev-parse', 'HEAD').strip()
+
+    def for_each_ref(self, *prefixes):
+        refs = {}
+        out = self.git('for-each-ref', '--format=%(objectname) %(refname) %(symref)',
+                       *prefixes)
+        for line in out.splitlines():
+            sha, refname, target = line.split(' ')
+            refs[refname] = (sha, target or None)
+        return refs
+
+    def read_refs(self, *prefixes):
+        return GitNative.read_refs(os.path.join(self.path, '.git'), list(prefixes))
+
+    def test_loose(self):
+        self.assertEqual(self.for_each_ref('refs/heads', 'refs/remotes', 'refs/tags'),
+                         self.read_refs('refs/heads', 'refs/remotes', 'refs/tags'))
+
+    def test_packed(self):
+        self.git('pack-refs', '--all')
+        refs = self.read_refs('refs/heads', 'refs/remotes', 'refs/tags')
+        self.assertEqual(self.for_each_ref('refs/heads', 'refs/remotes', 'refs/tags'), refs)
+        # the tag object, not the commit of the peeled line
+        self.assertEqual(self.git('rev-parse', 'v1').strip(), refs['refs/tags/v1'][0])
+        self.assertNotEqual(self.first, refs['refs/tags/v1'][0])
+
+    def test_loose_over_packed(self):
+        self.git('pack-refs', '--all')
+        second = self.commit('second')
+        refs = self.read_refs('refs/heads', 'refs/remotes')
+        self.assertEqual(self.for_each_ref('refs/heads', 'refs/remotes'), refs)
+        self.assertEqual(second, refs['refs/heads/master'][0])
+        self.assertEqual(self.first, refs['refs/heads/feature'][0])
+
+    def test_symref(self):
+        self.git('pack-refs', '--all')
+        second = self.commit('second')
+        self.git('update-ref', 'refs/remotes/origin/master', second)
+        refs = self.read_refs('refs/remotes')
+        self.assertEqual((second, 'refs/remotes/origin/master'),
+                         refs['refs/remotes/origin/HEAD'])
+
+    def test_prefixes(self):
+        refs = self.read_refs('refs/heads')
+        self.assertEqual(['refs/heads/feature', 'refs/heads/master'], sorted(refs))
+
+
+if __name__ == '__main__':
+    unittest.main()
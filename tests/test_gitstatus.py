@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import io
+import os
+import subprocess
+import unittest
+
+from reps.model.gitstatus import RepoStatus
+from reps.model.gitstatus import TrackingStatus
+from tests.test_gitnative import GitRepoTestCase
+
+
+SHA = '1234567890123456789012345678901234567890'
+
+
+class TestParsePorcelain(unittest.TestCase):
+    def parse(self, lines):
+        status = RepoStatus('repo')
+        status.parse_porcelain(lines)
+        return status
+
+    def test_clean(self):
+        status = self.parse([
+            '# branch.oid %s' % SHA,
+            '# branch.head master',
+            '# branch.upstream origin/master',
+            '# branch.ab +0 -0',
+            '',
+        ])
+        self.assertEqual('master', status.branch)
+        self.assertEqual(SHA, status.commit)
+        self.assertEqual('master', status.get_checked_out())
+        self.assertFalse(status.is_dirty())
+        self.assertEqual('clean', status.format_changes())
+
+    def test_changes(self):
+        status = self.parse([
+            '# branch.oid %s' % SHA,
+            '# branch.head master',
+            '1 M. N... 100644 100644 100644 %s %s staged' % (SHA, SHA),
+            '1 .M N... 100644 100644 100644 %s %s modified' % (SHA, SHA),
+            '1 MM N... 100644 100644 100644 %s %s both' % (SHA, SHA),
+            '2 R. N... 100644 100644 100644 %s %s R100 new\told' % (SHA, SHA),
+            'u UU N... 100644 100644 100644 100644 %s %s %s conflict' % (SHA, SHA, SHA),
+            '? untracked',
+            '! ignored',
+        ])
+        self.assertEqual(3, status.staged)
+        self.assertEqual(2, status.unstaged)
+        self.assertEqual(1, status.conflicts)
+        self.assertEqual(1, status.untracked)
+        self.assertTrue(status.is_dirty())
+        self.assertEqual('1 conflicts, 3 staged, 2 modified, 1 untracked',
+                         status.format_changes())
+
+    def test_detached(self):
+        status = self.parse(['# branch.oid %s' % SHA, '# branch.head (detached)'])
+        self.assertEqual(None, status.branch)
+        self.assertEqual(SHA, status.get_checked_out())
+        self.assertEqual('(detached at 1234567)', status.format_head())
+
+    def test_no_commits(self):
+        status = self.parse(['# branch.oid (initial)', '# branch.head master'])
+        self.assertEqual(None, status.commit)
+        self.assertEqual(None, status.get_checked_out())
+        self.assertEqual('master', status.format_head())
+
+
+class TestTrackingStatus(unittest.TestCase):
+    def test_from_track(self):
+        status = TrackingStatus.from_track('master', 'origin/master', 'ahead 1, behind 2')
+        self.assertEqual((1, 2, False), (status.ahead, status.behind, status.gone))
+        self.assertEqual('ahead 1, behind 2', status.format())
+        self.assertFalse(status.is_in_sync())
+
+    def test_in_sync(self):
+        status = TrackingStatus.from_track('master', 'origin/master', '')
+        self.assertTrue(status.is_in_sync())
+        self.assertEqual('up to date', status.format())
+
+    def test_gone(self):
+        status = TrackingStatus.from_track('master', 'origin/master', 'gone')
+        self.assertTrue(status.gone)
+        self.assertEqual('upstream gone', status.format())
+
+
+class TestFromCheckout(GitRepoTestCase):
+    def git(self, *args):
+        subprocess.check_call(['git', '-c', 'user.name=x', '-c', 'user.email=x@y'] +
+                              list(args), cwd=self.path)
+
+    def write(self, name, text):
+        with io.open(os.path.join(self.path, name), 'w', encoding='utf-8') as fp:
+            fp.write(text)
+
+    def test_from_checkout(self):
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/master')
+        self.write('a', u'a')
+        self.write('b', u'b')
+        self.git('add', 'a', 'b')
+        self.git('commit', '-q', '-m', 'first')
+        self.git('update-ref', 'refs/remotes/origin/master', 'HEAD')
+        self.git('config', 'remote.origin.fetch', '+refs/heads/*:refs/remotes/origin/*')
+        self.git('config', 'branch.master.remote', 'origin')
+        self.git('config', 'branch.master.merge', 'refs/heads/master')
+        self.git('commit', '-q', '--allow-empty', '-m', 'second')
+
+        self.write('a', u'changed')
+        self.write('b', u'staged')
+        self.git('add', 'b')
+        self.write('c', u'untracked')
+
+        status = RepoStatus.from_checkout(self.path)
+        self.assertEqual('master', status.branch)
+        self.assertEqual((1, 1, 1), (status.staged, status.unstaged, status.untracked))
+        self.assertEqual([('master', 'origin/master', 1, 0)],
+                         [(t.branch, t.upstream, t.ahead, t.behind)
+                          for t in status.tracking])
+
+        # a probe does not look for untracked files
+        status = RepoStatus.probe(self.path)
+        self.assertEqual((1, 1, 0), (status.staged, status.unstaged, status.untracked))
+        self.assertEqual([], status.tracking)
+
+
+if __name__ == '__main__':
+    unittest.main()
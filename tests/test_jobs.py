@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from reps.jobs import JobPool
+
+
+class Concurrency(object):
+    '''Counts the jobs running at once, overall and per key.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def enter(self, keys):
+        with self.lock:
+            for k in keys:
+                self.running[k] = self.running.get(k, 0) + 1
+                self.peak[k] = max(self.peak.get(k, 0), self.running[k])
+
+    def leave(self, keys):
+        with self.lock:
+            for k in keys:
+                self.running[k] -= 1
+
+    def run(self, keys, value):
+        keys = list(keys) + ['*']
+        self.enter(keys)
+        try:
+            time.sleep(0.01)
+            return value
+        finally:
+            self.leave(keys)
+
+
+class TestJobPool(unittest.TestCase):
+    def test_results_in_order(self):
+        pool = JobPool(jobs=4)
+        items = list(range(20))
+        self.assertEqual([i * 2 for i in items], pool.map(lambda i: i * 2, items))
+
+    def test_single_job(self):
+        pool = JobPool(jobs=None)
+        self.assertEqual(1, pool.jobs)
+        threads = pool.map(lambda i: threading.current_thread(), [1, 2])
+        self.assertEqual([threading.current_thread()] * 2, threads)
+
+    def test_jobs_limit(self):
+        counter = Concurrency()
+        JobPool(jobs=3).map(lambda i: counter.run([], i), range(12))
+        self.assertEqual(3, counter.peak['*'])
+
+    def test_key_limit(self):
+        counter = Concurrency()
+        items = [('a', i) for i in range(8)] + [('b', i) for i in range(8)]
+        limits = {'a': 1, 'b': 2}
+        results = JobPool(jobs=8).map(lambda item: counter.run([item[0]], item),
+                                      items, key=lambda item: [item[0]],
+                                      key_limit=limits.get)
+        self.assertEqual(items, results)
+        self.assertEqual(1, counter.peak['a'])
+        self.assertEqual(2, counter.peak['b'])
+        self.assertTrue(counter.peak['*'] > 2)
+
+    def test_no_key_limit(self):
+        counter = Concurrency()
+        JobPool(jobs=4).map(lambda i: counter.run(['a'], i), range(8),
+                            key=lambda i: ['a'], key_limit=lambda k: None)
+        self.assertEqual(4, counter.peak['a'])
+
+    def test_error(self):
+        started = []
+
+        def func(i):
+            started.append(i)
+            if i == 0:
+                raise ValueError('job failed')
+            time.sleep(0.01)
+            return i
+
+        pool = JobPool(jobs=2)
+        self.assertRaises(ValueError, pool.map, func, range(50))
+        # no new jobs are started once one has failed
+        self.assertTrue(len(started) < 50)
+
+    def test_walk(self):
+        tree = {'': ['a', 'b'], 'a': ['a/x', 'a/y'], 'b': ['b/z']}
+        for jobs in (1, 4):
+            seen = []
+            lock = threading.Lock()
+
+            def visit(node):
+                with lock:
+                    seen.append(node)
+                return tree.get(node, [])
+
+            JobPool(jobs=jobs).walk(visit, [''])
+            self.assertEqual(sorted(['', 'a', 'b', 'a/x', 'a/y', 'b/z']), sorted(seen))
+
+    def test_walk_error(self):
+        def visit(node):
+            if node == 'b':
+                raise ValueError('walk failed')
+            return {'': ['a', 'b']}.get(node, [])
+
+        self.assertRaises(ValueError, JobPool(jobs=4).walk, visit, [''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+
+import unittest
+
+from reps.model.git import Remote
+
+
+class TestRemoteRefspecs(unittest.TestCase):
+    def setUp(self):
+        self.remote = Remote(None, 'origin')
+
+    def test_refspecs(self):
+        self.remote.options['branches'] = 'master, feat/*'
+        self.remote.options['exclude'] = 'feat/y'
+        self.assertEqual([
+            '+refs/heads/master:refs/remotes/origin/master',
+            '+refs/heads/feat/*:refs/remotes/origin/feat/*',
+            '^refs/heads/feat/y',
+        ], self.remote.get_refspecs())
+
+    def test_branch_filter_refspecs(self):
+        self.remote.options['branches'] = 'master, feat/*'
+        self.remote.options['exclude'] = 'feat/y'
+        refspecs = self.remote.get_refspecs()
+        # the options may have been removed since they were written
+        del self.remote.options['branches']
+        del self.remote.options['exclude']
+        self.assertTrue(self.remote.is_branch_filter_refspecs(refspecs))
+        self.assertTrue(self.remote.is_branch_filter_refspecs(
+            ['+refs/heads/*:refs/remotes/origin/*', '^refs/heads/dev']))
+
+    def test_default_refspecs(self):
+        self.assertFalse(self.remote.is_branch_filter_refspecs([]))
+        self.assertFalse(self.remote.is_branch_filter_refspecs(
+            self.remote.get_default_refspecs()))
+
+    def test_user_refspecs(self):
+        self.assertFalse(self.remote.is_branch_filter_refspecs(
+            ['+refs/heads/*:refs/remotes/origin/*',
+             '+refs/pull/*:refs/remotes/origin/pr/*']))
+        self.assertFalse(self.remote.is_branch_filter_refspecs(
+            ['+refs/heads/master:refs/remotes/upstream/master']))
+        self.assertFalse(self.remote.is_branch_filter_refspecs(
+            ['refs/heads/master:refs/remotes/origin/master']))
+
+    def test_tag_option(self):
+        self.assertEqual(None, self.remote.get_tag_option())
+        self.remote.options['tags'] = 'none'
+        self.assertEqual('--no-tags', self.remote.get_tag_option())
+        self.remote.options['tags'] = 'all'
+        self.assertEqual('--tags', self.remote.get_tag_option())
+
+
+if __name__ == '__main__':
+    unittest.main()
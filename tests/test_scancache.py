@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from reps import consts
+from reps.scancache import ScanCache
+
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'a'))
+        # an mtime well before the scan, so that the listing is cached
+        self.old = 1000000000
+        self.set_mtime(self.old)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def set_mtime(self, mtime):
+        os.utime(self.root, (mtime, mtime))
+
+    def test_listing_is_cached(self):
+        cache = ScanCache(root=self.root)
+        self.assertEqual(([('a', False)], False), cache.list_dir(''))
+
+        # the directory is not listed again while its mtime is unchanged
+        os.mkdir(os.path.join(self.root, 'b'))
+        self.set_mtime(self.old)
+        self.assertEqual(([('a', False)], False), cache.list_dir(''))
+
+    def test_mtime_changed(self):
+        cache = ScanCache(root=self.root)
+        cache.list_dir('')
+
+        os.mkdir(os.path.join(self.root, 'b'))
+        open(os.path.join(self.root, consts.REPO_CONFIG), 'w').close()
+        self.set_mtime(self.old + 1)
+        dirs, marker = cache.list_dir('')
+        self.assertEqual([('a', False), ('b', False)], sorted(dirs))
+        self.assertTrue(marker)
+
+    def test_racy_listing_not_cached(self):
+        cache = ScanCache(root=self.root)
+        self.set_mtime(cache.started)
+        cache.list_dir('')
+        self.assertEqual({}, cache.dirs)
+
+    def test_repo_stamp(self):
+        cache = ScanCache(root=self.root)
+        cache.set_repo('a', self.old, [['origin', 'url', 'x']])
+        self.assertEqual([['origin', 'url', 'x']], cache.get_repo('a', self.old))
+        self.assertEqual(None, cache.get_repo('a', self.old + 1))
+
+        cache.set_repo('a', cache.started, [])
+        self.assertEqual(None, cache.get_repo('a', cache.started))
+
+    def test_save_and_load(self):
+        filepath = os.path.join(self.root, consts.REPO_SCAN_CACHE)
+        cache = ScanCache(filepath, root=self.root)
+        cache.list_dir('')
+        cache.set_repo('a', self.old, [])
+        cache.save()
+        self.set_mtime(self.old)
+
+        cache = ScanCache.load(filepath, root=self.root)
+        self.assertEqual([['a', False]], cache.list_dir('')[0])
+        self.assertEqual([], cache.get_repo('a', self.old))
+
+    def test_bad_cache_file(self):
+        filepath = os.path.join(self.root, consts.REPO_SCAN_CACHE)
+        with open(filepath, 'w') as fp:
+            fp.write('{')
+        cache = ScanCache.load(filepath, root=self.root)
+        self.assertEqual({}, cache.dirs)
+
+
+if __name__ == '__main__':
+    unittest.main()